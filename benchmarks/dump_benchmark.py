@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+Benchmark of object_dump on a generated dataset of the example app models.
+
+Fills a SQLite database with authors, their profiles and articles, and the
+categories and tags of the articles, then dumps the articles of some
+authors and times ``--estimate`` and each phase of the dump::
+
+    $ python benchmarks/dump_benchmark.py --authors 1000 --articles 20
+    $ python benchmarks/dump_benchmark.py --save-baseline baseline.json
+    $ python benchmarks/dump_benchmark.py --baseline baseline.json
+
+For each phase it reports the wall time, the number of queries, the peak
+RSS of the process so far and the objects handled per second. With
+``--baseline``, it exits with an error if a phase is slower, or runs more
+queries, than the baseline allows.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'example'))
+
+
+def setup(path):
+    from django.conf import settings
+    settings.configure(
+        DEBUG=False,
+        USE_TZ=True,
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}},
+        INSTALLED_APPS=('django.contrib.contenttypes', 'objectdump', 'simpleapp'),
+    )
+    import django
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0, interactive=False)
+
+
+def populate(authors, articles, categories, tags, fan_out, seed=42):
+    """
+    Create ``authors`` authors with a profile and ``articles`` articles
+    each. Every article is in ``fan_out`` of the ``categories`` categories
+    and tagged with ``fan_out`` of the ``tags`` tags.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from django.db import transaction
+    from django.utils import timezone
+    from simpleapp.models import Article, Author, AuthorProfile, Category, Tag, TaggedItem
+
+    rand = random.Random(seed)
+    with transaction.atomic():
+        Category.objects.bulk_create(
+            [Category(name="category %d" % i) for i in range(categories)])
+        Tag.objects.bulk_create([Tag(name="tag %d" % i) for i in range(tags)])
+        Author.objects.bulk_create([Author(name="author %d" % i) for i in range(authors)])
+        category_pks = list(Category.objects.values_list('pk', flat=True))
+        tag_pks = list(Tag.objects.values_list('pk', flat=True))
+        author_pks = list(Author.objects.values_list('pk', flat=True))
+        AuthorProfile.objects.bulk_create([
+            AuthorProfile(author_id=pk, date_of_birth=datetime.date(1970, 1, 1))
+            for pk in author_pks])
+        pub_date = timezone.now()
+        Article.objects.bulk_create([
+            Article(author_id=pk, headline="article %d of %d" % (i, pk), pub_date=pub_date)
+            for pk in author_pks for i in range(articles)])
+
+        through = Article.categories.through
+        article_ct = ContentType.objects.get_for_model(Article)
+        links = []
+        items = []
+        for article_pk in Article.objects.values_list('pk', flat=True).iterator():
+            for category_pk in rand.sample(category_pks, min(fan_out, len(category_pks))):
+                links.append(through(article_id=article_pk, category_id=category_pk))
+            for tag_pk in rand.sample(tag_pks, min(fan_out, len(tag_pks))):
+                items.append(TaggedItem(tag_id=tag_pk, content_type=article_ct, object_id=article_pk))
+        through.objects.bulk_create(links, batch_size=500)
+        TaggedItem.objects.bulk_create(items, batch_size=500)
+    return author_pks
+
+
+class NullStream(object):
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+def measure(phase, func, results):
+    from django.db import connection
+    from objectdump.stats import peak_rss, stop_counting_queries, take_queries
+    with stop_counting_queries(connection):
+        take_queries(connection)
+        start = time.time()
+        count = func()
+        elapsed = time.time() - start
+        queries = take_queries(connection)[0]
+    results[phase] = {
+        'seconds': elapsed,
+        'queries': queries,
+        'peak_rss_mb': peak_rss(),
+        'objects': count,
+        'objects_per_second': count / elapsed if elapsed else 0.0,
+    }
+
+
+def run(args):
+    from objectdump.estimate import Estimate
+    from objectdump.management.commands.object_dump import Command, get_fields
+    from objectdump.models import get_node_key, iter_node_chunks, ObjectFilter
+    from objectdump.serializer import get_serializer
+    from objectdump.topological_sort import toposort
+    from simpleapp.models import Author
+
+    author_pks = populate(args.authors, args.articles, args.categories, args.tags, args.fan_out)
+    roots = author_pks[:args.roots] if args.roots else author_pks
+    cmd = Command()
+    cmd.output = NullStream()
+    state = {}
+    results = {}
+
+    def traverse():
+        cmd.process_queue(Author.objects.filter(pk__in=roots).iterator(), ObjectFilter(Author),
+                          args.limit, args.depth)
+        return len(cmd.depends_on)
+
+    def sort():
+        state['order'] = list(toposort(cmd.depends_on, key=lambda n: get_node_key(n, as_tuple=True)))
+        return len(state['order'])
+
+    def serialize():
+        serializer = get_serializer(args.format, args.fast)()
+        fields, excluded = get_fields()
+        if hasattr(serializer, 'serialize_chunks'):
+            serializer.serialize_chunks(
+                iter_node_chunks(state['order']), stream=cmd.output,
+                fields=fields, exclude_fields=excluded)
+        else:
+            serializer.serialize(
+                cmd.stream_objects(state['order'], prefetch_m2m=serializer.batches_m2m()),
+                stream=cmd.output, fields=fields, exclude_fields=excluded)
+        return len(state['order'])
+
+    def estimate():
+        seen = Estimate(Command(), ObjectFilter(Author), args.limit, args.depth).run(Author, roots)
+        return sum(len(pks) for pks in seen.values())
+
+    measure('estimate', estimate, results)
+    measure('traversal', traverse, results)
+    measure('sorting', sort, results)
+    measure('serialization', serialize, results)
+    return results
+
+
+def report(results):
+    print("%-14s %10s %8s %10s %10s %12s" % (
+        'phase', 'time (s)', 'queries', 'RSS (MB)', 'objects', 'objects/s'))
+    for phase in ('estimate', 'traversal', 'sorting', 'serialization'):
+        r = results[phase]
+        print("%-14s %10.3f %8d %10.1f %10d %12.0f" % (
+            phase, r['seconds'], r['queries'], r['peak_rss_mb'], r['objects'],
+            r['objects_per_second']))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the regressions of ``results`` against ``baseline``: phases
+    slower than ``tolerance`` times the baseline or running more queries
+    """
+    regressions = []
+    for phase, base in sorted(baseline.items()):
+        result = results.get(phase)
+        if result is None:
+            continue
+        if result['seconds'] > base['seconds'] * tolerance:
+            regressions.append("%s took %.3fs, baseline %.3fs" % (
+                phase, result['seconds'], base['seconds']))
+        if result['queries'] > base['queries']:
+            regressions.append("%s ran %d queries, baseline %d" % (
+                phase, result['queries'], base['queries']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--authors', type=int, default=200)
+    parser.add_argument('--articles', type=int, default=10, help='articles per author')
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--tags', type=int, default=100)
+    parser.add_argument('--fan-out', type=int, default=3,
+                        help='categories and tags per article')
+    parser.add_argument('--roots', type=int, default=None,
+                        help='number of authors to dump, all by default')
+    parser.add_argument('--depth', type=int, default=None, help='object_dump --depth')
+    parser.add_argument('--limit', type=int, default=None, help='object_dump --limit')
+    parser.add_argument('--format', default='json')
+    parser.add_argument('--fast', action='store_true')
+    parser.add_argument('--save-baseline', metavar='FILE')
+    parser.add_argument('--baseline', metavar='FILE')
+    parser.add_argument('--tolerance', type=float, default=1.2,
+                        help='allowed slow down against the baseline')
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(fd)
+    try:
+        setup(path)
+        results = run(args)
+    finally:
+        os.remove(path)
+    report(results)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("Regression: %s" % regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
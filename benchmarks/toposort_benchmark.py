@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for ``objectdump.topological_sort.toposort``.
+
+Builds synthetic dependency graphs of ``('app', 'model', pk)`` nodes, like
+the keys object_dump sorts by, and times sorting them::
+
+    $ python benchmarks/toposort_benchmark.py --sizes 100000 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from objectdump.topological_sort import toposort  # NOQA
+
+
+def chain_graph(size):
+    """Every node depends on the previous one: the worst case of layering."""
+    nodes = [('app', 'model', i) for i in range(size)]
+    graph = dict((node, set()) for node in nodes)
+    for prev, node in zip(nodes, nodes[1:]):
+        graph[node].add(prev)
+    return graph
+
+
+def fan_in_graph(size, models=5):
+    """Many rows depending on a few shared rows, like articles and authors."""
+    shared = [('app', 'author', i) for i in range(max(1, size // 100))]
+    graph = dict((node, set()) for node in shared)
+    for i in range(size - len(shared)):
+        graph[('app', 'article%d' % (i % models), i)] = set([shared[i % len(shared)]])
+    return graph
+
+
+def random_dag(size, fan_out=3, seed=42):
+    """Each node depends on up to ``fan_out`` random earlier nodes."""
+    rand = random.Random(seed)
+    nodes = [('app', 'model%d' % (i % 7), i) for i in range(size)]
+    graph = {}
+    for i, node in enumerate(nodes):
+        graph[node] = set(nodes[rand.randrange(i)] for _ in range(fan_out) if i)
+    return graph
+
+
+GRAPHS = (
+    ('chain', chain_graph),
+    ('fan-in', fan_in_graph),
+    ('random', random_dag),
+)
+
+
+def run(sizes, repeat):
+    print("%-8s %10s %10s %12s %14s" % ('graph', 'nodes', 'edges', 'best (s)', 'nodes/s'))
+    for size in sizes:
+        for name, builder in GRAPHS:
+            graph = builder(size)
+            edges = sum(len(deps) for deps in graph.values())
+            best = None
+            for _ in range(repeat):
+                start = time.time()
+                count = sum(1 for _ in toposort(graph, key=lambda node: node))
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            assert count == size
+            print("%-8s %10d %10d %12.3f %14.0f" % (name, size, edges, best, size / best))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
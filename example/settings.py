@@ -26,7 +26,14 @@ DATABASES = {
         'PASSWORD': '',
         'HOST': '',
         'PORT': '',
-    }
+        # A file, so the threads of --concurrency see the test database too
+        'TEST': {'NAME': 'test.db'},
+    },
+    # Dumped with --database in the tests
+    'other': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'other.db',
+    },
 }
 
 # Local time zone for this installation. Choices can be found here:
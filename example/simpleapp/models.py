@@ -106,3 +106,8 @@ class Actor(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class AuthorProxy(Author):
+    class Meta:
+        proxy = True
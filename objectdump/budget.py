@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+The budget of a dump: the queries, objects and seconds its traversal may
+use before it's aborted or stops following relations.
+
+Queries are counted by wrapping the cursors of the database connection, like
+``--stats`` does. The threads of ``--concurrency`` count the queries of
+their own connections.
+"""
+import threading
+import time
+
+from django.db import connections
+
+from .stats import take_queries
+
+
+class Budget(object):
+    def __init__(self, using, max_queries=None, max_objects=None, max_seconds=None):
+        self.using = using
+        self.max_queries = max_queries
+        self.max_objects = max_objects
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.start = time.time()
+        self.reason = None  # set once the budget is spent
+        if max_queries is not None:
+            take_queries(connections[using])
+
+    def count_queries(self, stats=None):
+        """
+        Return the number of queries run so far, adding those counted on the
+        connection of the calling thread. With ``stats``, the queries are
+        taken by ``stats`` and counted there.
+        """
+        if stats is not None:
+            return stats.queries
+        with self.lock:
+            self.queries += take_queries(connections[self.using])[0]
+            return self.queries
+
+    def check(self, objects, stats=None):
+        """
+        Return why the budget is spent, with ``objects`` collected so far,
+        or ``None`` if it isn't
+        """
+        if self.reason is not None:
+            return self.reason
+        if self.max_seconds is not None and time.time() - self.start > self.max_seconds:
+            self.reason = "more than %s seconds" % self.max_seconds
+        elif self.max_objects is not None and objects > self.max_objects:
+            self.reason = "more than %d objects" % self.max_objects
+        elif self.max_queries is not None and self.count_queries(stats) > self.max_queries:
+            self.reason = "more than %d queries" % self.max_queries
+        return self.reason
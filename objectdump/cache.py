@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+A cache of the relations of traversed objects, kept in a SQLite file between
+runs of object_dump.
+
+Each entry holds the ``(field, related node)`` edges found for one node with
+a given configuration (``--limit``, filters and relation settings). An entry
+is only used while the version of its model, and of every model holding
+rows that point at it, is unchanged. The version of a model is the number of
+rows and the latest value of its ``updated_field`` setting. Through tables
+of many-to-many fields use their latest pk instead, since their rows are
+only ever added or deleted. Other models aren't cached.
+
+The least recently used entries are evicted once the cache holds more than
+``max_edges`` edges.
+"""
+import hashlib
+import sqlite3
+import time
+
+from django.db.models import Count, Max
+from django.utils.encoding import force_text
+
+from .models import get_content_type_id, get_node_model
+from .settings import MODEL_SETTINGS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    config TEXT,
+    ct INTEGER,
+    pk TEXT,
+    stamp TEXT,
+    used REAL,
+    size INTEGER,
+    UNIQUE (config, ct, pk)
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+CREATE TABLE IF NOT EXISTS edges (
+    entry INTEGER,
+    field TEXT,
+    ct INTEGER,
+    pk TEXT,
+    depends INTEGER
+);
+CREATE INDEX IF NOT EXISTS edges_entry ON edges (entry);
+"""
+
+RELATION_SETTINGS = ('ignore', 'fk_fields', 'm2m_fields', 'reverse_relations', 'gfk_fields')
+
+
+def pk_to_python(model, value):
+    field = model._meta.pk
+    while field.rel is not None:
+        field = field.rel.get_related_field()
+    return field.to_python(value)
+
+
+def get_config(*args):
+    """
+    Return a digest of ``args`` and of the relation settings of all models
+    """
+    settings = sorted(
+        (key, sorted((name, value) for name, value in attrs.items() if name in RELATION_SETTINGS))
+        for key, attrs in MODEL_SETTINGS.items())
+    return hashlib.sha1(repr((args, settings)).encode('utf-8')).hexdigest()
+
+
+class GraphCache(object):
+    def __init__(self, path, config, using, max_edges=1000000):
+        self.path = path
+        self.config = config
+        self.using = using
+        self.max_edges = max_edges
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.versions = {}  # {model: version}
+        self.stamps = {}  # {model: stamp}
+        self.loaded_ct = {}  # {ct id: model}
+
+    def get_version(self, model):
+        """
+        Return the version of the rows of ``model``, or ``None`` if changes
+        to them can't be detected
+        """
+        if model in self.versions:
+            return self.versions[model]
+        opts = model._meta
+        key = ".".join([opts.app_label, opts.model_name])
+        updated_field = MODEL_SETTINGS.get(key, {}).get('updated_field')
+        if updated_field is None and opts.auto_created:
+            updated_field = 'pk'
+        version = None
+        if updated_field is not None:
+            version = model._base_manager.using(self.using).aggregate(
+                count=Count('pk'), latest=Max(updated_field))
+            version = (version['count'], force_text(version['latest']))
+        self.versions[model] = version
+        return version
+
+    def get_stamp(self, plan):
+        """
+        Return the stamp of the entries of the model of ``plan``: a digest of
+        the versions of the models its relations are read from, or ``None``
+        if they can't be cached.
+        """
+        if plan.model in self.stamps:
+            return self.stamps[plan.model]
+        models = [plan.model]
+        for rel, field in plan.reverse_relations:
+            models.append(field and field.model)
+        for rel, field in plan.many_to_many:
+            models.append(field and field.rel.through)
+        models.extend(field.rel.to for field in plan.generic_relations)
+        stamp = None
+        if not plan.additional_relations and None not in models:
+            versions = [(get_content_type_id(model), self.get_version(model)) for model in models]
+            if None not in [version for ct_id, version in versions]:
+                stamp = hashlib.sha1(repr(sorted(versions)).encode('utf-8')).hexdigest()
+        self.stamps[plan.model] = stamp
+        return stamp
+
+    def get_model(self, ct_id):
+        if ct_id not in self.loaded_ct:
+            self.loaded_ct[ct_id] = get_node_model((ct_id, None))
+        return self.loaded_ct[ct_id]
+
+    def get(self, nodes, stamp):
+        """
+        Return ``{node: [(field, related node, depends)]}`` for the ``nodes``,
+        of the same model, with an entry made with ``stamp``
+        """
+        found = {}
+        if not nodes:
+            return found
+        ct_id = nodes[0][0]
+        by_pk = dict((force_text(pk), (ct, pk)) for ct, pk in nodes)
+        entries = {}
+        pks = list(by_pk.keys())
+        for i in range(0, len(pks), 500):
+            chunk = pks[i:i + 500]
+            rows = self.db.execute(
+                "SELECT id, pk FROM entries WHERE config = ? AND ct = ? AND stamp = ? "
+                "AND pk IN (%s)" % ", ".join("?" * len(chunk)),
+                [self.config, ct_id, stamp] + chunk)
+            entries.update((entry_id, by_pk[pk]) for entry_id, pk in rows)
+        ids = list(entries.keys())
+        for node in entries.values():
+            found[node] = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = self.db.execute(
+                "SELECT entry, field, ct, pk, depends FROM edges WHERE entry IN (%s)" %
+                ", ".join("?" * len(chunk)), chunk)
+            for entry_id, field, rel_ct_id, rel_pk, depends in rows:
+                rel_node = (rel_ct_id, pk_to_python(self.get_model(rel_ct_id), rel_pk))
+                found[entries[entry_id]].append((field, rel_node, bool(depends)))
+            with self.db:
+                self.db.execute(
+                    "UPDATE entries SET used = ? WHERE id IN (%s)" % ", ".join("?" * len(chunk)),
+                    [time.time()] + chunk)
+        return found
+
+    def put(self, edges, stamp):
+        """
+        Save the ``{node: [(field, related node, depends)]}`` ``edges``
+        found with ``stamp`` and evict the oldest entries beyond the limit
+        """
+        now = time.time()
+        with self.db:
+            for (ct_id, pk), node_edges in edges.items():
+                self.db.execute(
+                    "DELETE FROM edges WHERE entry IN (SELECT id FROM entries "
+                    "WHERE config = ? AND ct = ? AND pk = ?)", (self.config, ct_id, force_text(pk)))
+                cursor = self.db.execute(
+                    "INSERT OR REPLACE INTO entries (config, ct, pk, stamp, used, size) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.config, ct_id, force_text(pk), stamp, now, len(node_edges)))
+                self.db.executemany("INSERT INTO edges VALUES (?, ?, ?, ?, ?)", (
+                    (cursor.lastrowid, force_text(field), rel_ct_id, force_text(rel_pk), int(depends))
+                    for field, (rel_ct_id, rel_pk), depends in node_edges))
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries while there are more than
+        ``max_edges`` edges
+        """
+        total = self.db.execute("SELECT COALESCE(SUM(size + 1), 0) FROM entries").fetchone()[0]
+        if total <= self.max_edges:
+            return
+        with self.db:
+            for entry_id, size in self.db.execute(
+                    "SELECT id, size FROM entries ORDER BY used").fetchall():
+                self.db.execute("DELETE FROM edges WHERE entry = ?", (entry_id, ))
+                self.db.execute("DELETE FROM entries WHERE id = ?", (entry_id, ))
+                total -= size + 1
+                if total <= self.max_edges:
+                    break
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints of object_dump, saved in a SQLite file, so a long dump that
+failed can be resumed where it stopped.
+
+A checkpoint holds the key-only graph, the nodes that were traversed and the
+nodes of the next level during the traversal, then the nodes that were
+written and the size of the output file during the serialization. The
+graph is saved incrementally: each save only adds the nodes and edges found
+since the previous one.
+"""
+import sqlite3
+from collections import defaultdict
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+TABLES = {
+    'state': 'name TEXT PRIMARY KEY, value BLOB',
+    'priors': 'node BLOB, serialized INTEGER',
+    'queue': 'node BLOB',
+    'depends_on': 'node BLOB, dep BLOB',
+    'relationships': 'node BLOB, field TEXT, rel_node BLOB',
+    'generates': 'node BLOB, rel_node BLOB',
+    'emitted': 'node BLOB',
+}
+
+
+def dump(value):
+    return sqlite3.Binary(pickle.dumps(value, 2))
+
+
+def load(value):
+    return pickle.loads(bytes(value))
+
+
+class Checkpoint(object):
+    """
+    A checkpoint file. With ``reset``, anything already in it is removed.
+    """
+    def __init__(self, path, reset=False):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        with self.db:
+            for table, columns in TABLES.items():
+                if reset:
+                    self.db.execute("DROP TABLE IF EXISTS %s" % table)
+                self.db.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (table, columns))
+
+    def get(self, name, default=None):
+        row = self.db.execute("SELECT value FROM state WHERE name = ?", (name, )).fetchone()
+        return default if row is None else load(row[0])
+
+    def set(self, name, value):
+        self.db.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (name, dump(value)))
+
+    def save_traversal(self, cmd, depth):
+        """
+        Replace the saved traversal with the graph, priors and queue of
+        ``cmd`` before the level ``depth``
+        """
+        with self.db:
+            for table in ('priors', 'queue', 'depends_on', 'relationships', 'generates'):
+                self.db.execute("DELETE FROM %s" % table)
+            self.db.executemany("INSERT INTO priors VALUES (?, ?)", (
+                (dump(node), serialized) for node, serialized in cmd.priors.items()))
+            self.db.executemany("INSERT INTO queue VALUES (?)", (
+                (dump(node), ) for node in cmd.queue_nodes()))
+            self.db.executemany("INSERT INTO depends_on VALUES (?, ?)", (
+                (dump(node), dump(dep))
+                for node, deps in cmd.depends_on.items() for dep in deps or [None]))
+            self.db.executemany("INSERT INTO relationships VALUES (?, ?, ?)", (
+                (dump(node), field, dump(rel_node))
+                for node, fields in cmd.relationships.items()
+                for field, rel_nodes in fields.items() for rel_node in rel_nodes))
+            self.db.executemany("INSERT INTO generates VALUES (?, ?)", (
+                (dump(node), dump(rel_node))
+                for node, rel_nodes in cmd.generates.items() for rel_node in rel_nodes))
+            self.set('depth', depth)
+
+    def add_traversal(self, journal, queue, depth):
+        """
+        Add the rows of ``journal``, ``{table: rows}``, to the saved graph
+        and priors, and replace the saved queue with the nodes of ``queue``
+        before the level ``depth``. This only writes what a level added to
+        the graph, instead of the whole graph like ``save_traversal``.
+        """
+        with self.db:
+            self.db.executemany("INSERT INTO priors VALUES (?, ?)", (
+                (dump(node), serialized) for node, serialized in journal['priors']))
+            self.db.execute("DELETE FROM queue")
+            self.db.executemany("INSERT INTO queue VALUES (?)", (
+                (dump(node), ) for node in queue))
+            self.db.executemany("INSERT INTO depends_on VALUES (?, ?)", (
+                (dump(node), dump(dep)) for node, dep in journal['depends_on']))
+            self.db.executemany("INSERT INTO relationships VALUES (?, ?, ?)", (
+                (dump(node), field, dump(rel_node))
+                for node, field, rel_node in journal['relationships']))
+            self.db.executemany("INSERT INTO generates VALUES (?, ?)", (
+                (dump(node), dump(rel_node)) for node, rel_node in journal['generates']))
+            self.set('depth', depth)
+
+    def load_traversal(self, cmd):
+        """
+        Restore the graph and priors of ``cmd``. Returns the nodes of the
+        queue and the depth of the level to traverse next, or ``None`` if no
+        traversal was saved.
+        """
+        depth = self.get('depth')
+        if depth is None:
+            return None
+        cmd.priors = dict(
+            (load(node), bool(serialized))
+            for node, serialized in self.db.execute("SELECT node, serialized FROM priors"))
+        cmd.depends_on = defaultdict(set)
+        for node, dep in self.db.execute("SELECT node, dep FROM depends_on"):
+            dep = load(dep)
+            if dep is None:
+                cmd.depends_on[load(node)]
+            else:
+                cmd.depends_on[load(node)].add(dep)
+        cmd.relationships = defaultdict(lambda: defaultdict(set))
+        for node, field, rel_node in self.db.execute("SELECT node, field, rel_node FROM relationships"):
+            cmd.relationships[load(node)][field].add(load(rel_node))
+        cmd.generates = defaultdict(set)
+        for node, rel_node in self.db.execute("SELECT node, rel_node FROM generates"):
+            cmd.generates[load(node)].add(load(rel_node))
+        queue = [load(node) for node, in self.db.execute("SELECT node FROM queue")]
+        return queue, depth
+
+    def add_emitted(self, nodes, offset):
+        """
+        Record that ``nodes`` were written and the output is now ``offset``
+        bytes long
+        """
+        with self.db:
+            self.db.executemany("INSERT INTO emitted VALUES (?)", ((dump(node), ) for node in nodes))
+            self.set('offset', offset)
+
+    def get_emitted(self):
+        return set(load(node) for node, in self.db.execute("SELECT node FROM emitted"))
+
+    def reset_emitted(self):
+        with self.db:
+            self.db.execute("DELETE FROM emitted")
+            self.db.execute("DELETE FROM state WHERE name = 'offset'")
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Delta dumps: the objects that changed, or became part of the dump, since a
+previous dump whose graph was saved as a snapshot.
+
+The rows changed since then are found with the ``updated_field`` of their
+model in ``MODEL_SETTINGS``. Only the changed nodes, and the nodes whose
+relations they may have changed, are traversed again; the rest of the graph
+comes from the snapshot. Many-to-many links are only seen when one of the
+linked rows was updated too.
+"""
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+
+from .models import (get_model, get_content_type_id, get_node_model, chunked,
+                     hydrate, warm_content_types)
+from .settings import MODEL_SETTINGS
+
+
+def get_changed(since, using):
+    """
+    Return the nodes of the rows updated since ``since``, for the models
+    with an ``updated_field``
+    """
+    changed = set()
+    for key, attrs in MODEL_SETTINGS.items():
+        if 'updated_field' not in attrs:
+            continue
+        model = get_model(*key.split("."))._meta.concrete_model
+        ct_id = get_content_type_id(model)
+        pks = model._base_manager.using(using).filter(
+            **{"%s__gte" % attrs['updated_field']: since}).values_list('pk', flat=True)
+        changed.update((ct_id, pk) for pk in pks.iterator())
+    return changed
+
+
+def get_deleted(nodes, using):
+    """
+    Return the ``nodes`` whose rows don't exist anymore
+    """
+    by_ct = defaultdict(list)
+    for ct_id, pk in nodes:
+        by_ct[ct_id].append(pk)
+    # Nodes hold content type ids of the default database
+    warm_content_types(by_ct.keys())
+    deleted = set()
+    for ct_id, pks in by_ct.items():
+        model = get_node_model((ct_id, None))
+        if model is None:
+            deleted.update((ct_id, pk) for pk in pks)
+            continue
+        manager = model._base_manager.using(using)
+        for chunk in chunked(pks):
+            existing = set(manager.filter(pk__in=chunk).values_list('pk', flat=True))
+            deleted.update((ct_id, pk) for pk in chunk if pk not in existing)
+    return deleted
+
+
+def get_targets(cmd, obj):
+    """
+    Return the nodes the foreign keys and generic foreign keys of ``obj``
+    point at
+    """
+    plan = cmd.get_plan(obj.__class__)
+    targets = set()
+    for field in plan.foreign_keys:
+        value = getattr(obj, field.attname)
+        rel_model = field.rel.to._meta.concrete_model
+        if value is not None and field.rel.get_related_field().primary_key:
+            targets.add((get_content_type_id(rel_model), value))
+    for field in plan.generic_foreign_keys:
+        ct_id = getattr(obj, obj._meta.get_field(field.ct_field).attname)
+        object_id = getattr(obj, field.fk_field)
+        if ct_id is None or object_id is None:
+            continue
+        # Read from the row, so a content type of the dumped database
+        rel_model = ContentType.objects.db_manager(cmd.using).get_for_id(ct_id).model_class()
+        if rel_model is not None:
+            rel_model = rel_model._meta.concrete_model
+            targets.add((get_content_type_id(rel_model), rel_model._meta.pk.to_python(object_id)))
+    return targets
+
+
+def reachable(roots, graph):
+    """
+    Return the nodes of ``graph``, ``{node: set(nodes)}``, reachable from
+    ``roots``
+    """
+    seen = set(roots)
+    stack = list(seen)
+    while stack:
+        for node in graph.get(stack.pop(), ()):
+            if node not in seen:
+                seen.add(node)
+                stack.append(node)
+    return seen
+
+
+def traverse_delta(cmd, snapshot, since, roots, obj_filter=None):
+    """
+    Build the graph of the dump from the graph saved in ``snapshot`` and the
+    rows updated since ``since``, in the ``depends_on``, ``relationships``,
+    ``generates`` and ``priors`` of ``cmd``, as ``cmd.process_queue`` would
+    from the ``roots`` queryset.
+
+    Returns the set of nodes to dump, that changed or weren't in the
+    snapshot, and the set of nodes of the snapshot that aren't part of the
+    dump anymore. Returns ``None`` if the snapshot has no graph.
+    """
+    saved = snapshot.load_traversal(cmd)
+    if saved is None:
+        return None
+    old = set(node for node, serialized in cmd.priors.items() if serialized)
+
+    changed = get_changed(since, cmd.using)
+    deleted = get_deleted(list(cmd.priors.keys()), cmd.using)
+
+    # The relations of a node depend on its row and on the rows pointing to
+    # it, so the nodes related to a changed row, before or after the change,
+    # are traversed again as well.
+    dirty = set(node for node in changed if node in cmd.priors)
+    for node, rel_nodes in cmd.generates.items():
+        if not rel_nodes.isdisjoint(changed):
+            dirty.add(node)
+    cmd.plans = {}
+    cmd.obj_filter = obj_filter
+    for obj in hydrate(changed, cmd.using):
+        dirty.update(node for node in get_targets(cmd, obj) if node in cmd.priors)
+    dirty -= deleted
+
+    for node in deleted | dirty:
+        cmd.priors.pop(node, None)
+        cmd.depends_on.pop(node, None)
+        cmd.relationships.pop(node, None)
+        cmd.generates.pop(node, None)
+    for graph in (cmd.depends_on, cmd.generates):
+        for node, rel_nodes in graph.items():
+            rel_nodes.difference_update(deleted)
+    for node, fields in cmd.relationships.items():
+        for rel_nodes in fields.values():
+            rel_nodes.difference_update(deleted)
+
+    ct_id = get_content_type_id(roots.model)
+    root_nodes = set((ct_id, pk) for pk in roots.values_list('pk', flat=True).iterator())
+    cmd.queue = list(hydrate(dirty | (root_nodes - set(cmd.priors)), cmd.using))
+    cmd.traverse(0, obj_filter)
+
+    # Drop what can't be reached from the roots anymore
+    keep = reachable(root_nodes, cmd.generates)
+    for graph in (cmd.priors, cmd.depends_on, cmd.relationships, cmd.generates):
+        for node in list(graph.keys()):
+            if node not in keep:
+                del graph[node]
+    for node, deps in cmd.depends_on.items():
+        deps.intersection_update(keep)
+
+    new = set(node for node, serialized in cmd.priors.items() if serialized)
+    return set(node for node in new if node in changed or node not in old), old - new
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Estimates of the size of a dump, for ``--estimate``.
+
+The related objects are collected level by level, following the same
+relation plans as the traversal, but only their pks are read, with
+``values_list`` queries. Objects are only loaded for the relations that
+can't be read that way: ``addl_relations`` and relation names without a
+field. The size of the fixture is projected from the serialized size of a
+sample of the objects of each model.
+"""
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.utils import six
+
+from .models import chunked, get_ordering, warm_content_types
+
+SAMPLE_SIZE = 20
+
+
+class Estimate(object):
+    """
+    The objects ``cmd`` would dump, as ``{concrete model: set(pks)}``
+    """
+    def __init__(self, cmd, obj_filter=None, limit=None, max_depth=None):
+        self.cmd = cmd
+        self.using = cmd.using
+        self.obj_filter = obj_filter
+        self.limit = limit
+        self.max_depth = max_depth
+        self.seen = defaultdict(set)
+        cmd.plans = {}
+        cmd.obj_filter = obj_filter
+
+    def add(self, model, pks, level):
+        """
+        Add the ``pks`` of ``model`` that weren't seen yet to ``level``
+        """
+        model = model._meta.concrete_model
+        if self.obj_filter is not None and self.obj_filter.skip_model(model):
+            return
+        new = set(pk for pk in pks if pk is not None) - self.seen[model]
+        if new:
+            self.seen[model].update(new)
+            level[model].update(new)
+
+    def run(self, model, pks):
+        level = defaultdict(set)
+        self.add(model, pks, level)
+        depth = 0
+        while level:
+            next_level = defaultdict(set)
+            full = self.max_depth is None or depth <= self.max_depth
+            for model, model_pks in level.items():
+                for pks in chunked(model_pks):
+                    self.follow(model, pks, full, next_level)
+            level = next_level
+            depth += 1
+        return self.seen
+
+    def follow(self, model, pks, full, level):
+        """
+        Add the objects related to the ``pks`` of ``model`` to ``level``.
+        Unless ``full``, only their foreign keys are followed, as beyond
+        ``--depth``.
+        """
+        plan = self.cmd.get_plan(model)
+        loaded = [rel for rel, field in plan.reverse_relations + plan.many_to_many if field is None]
+        if full:
+            for rel, field in plan.reverse_relations:
+                if field is not None:
+                    self.add(field.model, self.reverse_foreignkey(model, field, pks), level)
+            for rel, field in plan.many_to_many:
+                if field is not None:
+                    self.add(field.rel.to, self.many2many(field, pks), level)
+            for field in plan.generic_relations:
+                self.add(field.rel.to, self.generic_relation(model, field, pks), level)
+        self.foreign_keys(model, plan, pks, level)
+        if plan.additional_relations or (full and loaded):
+            for obj in model._base_manager.using(self.using).filter(pk__in=pks):
+                if full:
+                    for rel in loaded:
+                        for rel_obj in self.cmd.get_related_objects(obj, rel, self.limit):
+                            self.add(rel_obj.__class__, [rel_obj.pk], level)
+                for rel, rel_obj, add_dependency in self.cmd.iter_additional_relations(obj):
+                    self.add(rel_obj.__class__, [rel_obj.pk], level)
+
+    def limited(self, rows):
+        """
+        Return the pks of the ``(value, pk)`` rows, keeping the first
+        ``limit`` of each value
+        """
+        if not self.limit:
+            return [pk for value, pk in rows]
+        counts = defaultdict(int)
+        output = []
+        for value, pk in rows:
+            if counts[value] < self.limit:
+                counts[value] += 1
+                output.append(pk)
+        return output
+
+    def reverse_foreignkey(self, model, field, pks):
+        target = field.rel.get_related_field()
+        if not target.primary_key:
+            pks = model._base_manager.using(self.using).filter(
+                pk__in=pks).values_list(target.attname, flat=True)
+        queryset = field.model._default_manager.using(self.using)
+        if self.limit:
+            queryset = queryset.order_by(*get_ordering(field.model))
+        return self.limited(queryset.filter(
+            **{"%s__in" % field.name: list(pks)}).values_list(field.attname, 'pk'))
+
+    def many2many(self, field, pks):
+        through = field.rel.through
+        target_name = field.m2m_reverse_field_name()
+        source_attname = through._meta.get_field(field.m2m_field_name()).attname
+        target_attname = through._meta.get_field(target_name).attname
+        queryset = through._default_manager.using(self.using)
+        if self.limit:
+            queryset = queryset.order_by(*get_ordering(field.rel.to, target_name))
+        targets = set(self.limited(queryset.filter(
+            **{"%s__in" % source_attname: pks}).values_list(source_attname, target_attname)))
+        # The traversal skips the rows the default manager of the target
+        # model doesn't return
+        rel_model = field.rel.to
+        missing = targets - self.seen[rel_model._meta.concrete_model]
+        manager = rel_model._default_manager.using(self.using)
+        existing = set()
+        for chunk in chunked(missing):
+            existing.update(manager.filter(pk__in=chunk).values_list('pk', flat=True))
+        return existing
+
+    def generic_relation(self, model, field, pks):
+        ct = ContentType.objects.db_manager(self.using).get_for_model(
+            model, for_concrete_model=field.for_concrete_model)
+        rel_model = field.rel.to
+        queryset = rel_model._default_manager.using(self.using).filter(
+            **{field.content_type_field_name: ct})
+        if self.limit:
+            queryset = queryset.order_by(*get_ordering(rel_model))
+        to_python = model._meta.pk.to_python
+        return self.limited(
+            (to_python(object_id), pk) for object_id, pk in queryset.filter(
+                **{"%s__in" % field.object_id_field_name: pks}).values_list(
+                field.object_id_field_name, 'pk'))
+
+    def foreign_keys(self, model, plan, pks, level):
+        """
+        Add the targets of the foreign keys and generic foreign keys of the
+        ``pks`` of ``model`` to ``level``, reading them with one query
+        """
+        gfk_columns = [(model._meta.get_field(field.ct_field).attname, field.fk_field)
+                       for field in plan.generic_foreign_keys]
+        columns = [field.attname for field in plan.foreign_keys]
+        for ct_attname, fk_field in gfk_columns:
+            columns.extend([ct_attname, fk_field])
+        if not columns:
+            return
+        rows = list(model._base_manager.using(self.using).filter(
+            pk__in=pks).values_list(*columns))
+        for i, field in enumerate(plan.foreign_keys):
+            rel_model = field.rel.to
+            values = set(row[i] for row in rows if row[i] is not None)
+            target = field.rel.get_related_field()
+            if not target.primary_key and values:
+                values = rel_model._base_manager.using(self.using).filter(
+                    **{"%s__in" % target.attname: list(values)}).values_list('pk', flat=True)
+            self.add(rel_model, values, level)
+        by_ct = defaultdict(set)
+        offset = len(plan.foreign_keys)
+        for i in range(len(gfk_columns)):
+            for row in rows:
+                ct_id, object_id = row[offset + 2 * i], row[offset + 2 * i + 1]
+                if ct_id is not None and object_id is not None:
+                    by_ct[ct_id].add(object_id)
+        content_types = ContentType.objects.db_manager(self.using)
+        warm_content_types(by_ct.keys(), self.using)
+        for ct_id, object_ids in by_ct.items():
+            rel_model = content_types.get_for_id(ct_id).model_class()
+            if rel_model is None:
+                continue
+            to_python = rel_model._meta.pk.to_python
+            self.add(rel_model, [to_python(value) for value in object_ids], level)
+
+
+def projected_sizes(seen, serializer, using, **options):
+    """
+    Return ``{model: bytes}``, the projected size of the objects of each
+    model once serialized, from a sample of at most ``SAMPLE_SIZE`` of them
+    """
+    stream = six.StringIO()
+    serializer.serialize([], stream=stream, **options)
+    overhead = len(stream.getvalue())
+    sizes = {}
+    for model, pks in seen.items():
+        sample = list(model._base_manager.using(using).filter(pk__in=list(pks)[:SAMPLE_SIZE]))
+        if not sample:
+            sizes[model] = 0
+            continue
+        stream = six.StringIO()
+        serializer.serialize(sample, stream=stream, **options)
+        sizes[model] = (len(stream.getvalue()) - overhead) * len(pks) // len(sample)
+    return sizes
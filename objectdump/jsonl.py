@@ -0,0 +1,64 @@
+"""
+Serialize data to and from JSON Lines: one JSON object per line.
+
+Each object is written as soon as it is serialized and can be read back
+without parsing the whole fixture, so large fixtures can be tailed, split and
+loaded in pieces. To load them with ``loaddata``, register the format::
+
+    SERIALIZATION_MODULES = {'jsonl': 'objectdump.jsonl'}
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import sys
+
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.json import Serializer as JSONSerializer, DjangoJSONEncoder
+from django.core.serializers.python import Deserializer as PythonDeserializer
+from django.utils import six
+
+
+class Serializer(JSONSerializer):
+    """
+    Convert a queryset to JSON Lines.
+    """
+    def start_serialization(self):
+        self._init_options()
+        # One object per line, so no pretty-printing
+        if self.json_kwargs.pop('indent', None):
+            self.json_kwargs.pop('separators', None)
+
+    def end_serialization(self):
+        pass
+
+    def end_object(self, obj):
+        json.dump(self.get_dump_object(obj), self.stream,
+                  cls=DjangoJSONEncoder, **self.json_kwargs)
+        self.stream.write("\n")
+        self._current = None
+
+
+def Deserializer(stream_or_string, **options):
+    """
+    Deserialize a stream or string of JSON Lines, one line at a time.
+    """
+    if isinstance(stream_or_string, bytes):
+        stream_or_string = stream_or_string.decode('utf-8')
+    if isinstance(stream_or_string, six.string_types):
+        stream_or_string = stream_or_string.split("\n")
+
+    def objects():
+        for line in stream_or_string:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if line.strip():
+                yield json.loads(line)
+    try:
+        for obj in PythonDeserializer(objects(), **options):
+            yield obj
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        # Map to deserializer error
+        six.reraise(DeserializationError, DeserializationError(e), sys.exc_info()[2])
@@ -1,19 +1,65 @@
+import datetime
+import json
 import pprint
+import time
+import warnings
 from optparse import make_option
 from collections import defaultdict, Iterable
-from django.db import DEFAULT_DB_ALIAS
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from django.db import connections, DEFAULT_DB_ALIAS
 
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import FieldError, ObjectDoesNotExist
 from django.core.management.base import BaseCommand, CommandError
-from django.db.models import ForeignKey
 from django.apps import apps
 from django.db import models
+from django.conf import settings
 from django.template import Variable
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.six.moves import zip
 
-from objectdump.models import get_key, get_reverse_relations, get_many_to_many, ObjectFilter
+from objectdump.models import (get_node, get_node_key, get_content_type_id,
+                               get_concrete, get_ordering, group_by_model,
+                               warm_content_types, hydrate, get_node_model,
+                               chunked, hydrate_chunks, iter_node_chunks,
+                               ObjectFilter)
 from objectdump.settings import MODEL_SETTINGS
-from objectdump.serializer import get_serializer
+from objectdump.serializer import get_serializer, has_fast_path, prefetch_m2m_values
 from objectdump.diagram import make_dot
+from objectdump.output import open_output, is_compressed
+from objectdump.cache import GraphCache, get_config
+from objectdump.checkpoint import Checkpoint
+from objectdump.stats import Stats, get_model_key, stop_counting_queries
+from objectdump.budget import Budget
+from objectdump import signals
+from objectdump.delta import traverse_delta
+from objectdump.estimate import Estimate, projected_sizes
+from objectdump.plan import RelationPlan
+from objectdump.topological_sort import toposort, CyclicDependencyWarning
+from objectdump.workers import traverse_parallel
+
+
+@contextmanager
+def nothing():
+    yield
+
+
+def parse_since(value):
+    """
+    Parse the date and time of ``--since``, in the current time zone unless
+    it says otherwise
+    """
+    since = parse_datetime(value)
+    if since is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError("Invalid --since date: %s" % value)
+        since = datetime.datetime.combine(day, datetime.time())
+    if settings.USE_TZ and timezone.is_naive(since):
+        since = timezone.make_aware(since, timezone.get_current_timezone())
+    return since
 
 
 def get_fields():
@@ -39,7 +85,8 @@ class Command(BaseCommand):
         make_option('--format',
             default='json',
             dest='format',
-            help='Specifies the output serialization format for fixtures.'),
+            help='Specifies the output serialization format for fixtures. '
+                 'jsonl writes one object per line.'),
         make_option('--indent',
             default=None,
             dest='indent',
@@ -67,6 +114,93 @@ class Command(BaseCommand):
             default=None,
             type='int',
             help='Max depth related objects to get'),
+        make_option('--estimate',
+            action='store_true',
+            dest='estimate',
+            default=False,
+            help='Only print the number of objects of each model the dump '
+                 'would hold and its projected size, reading only their pks'),
+        make_option('--max-queries',
+            dest='max_queries',
+            default=None,
+            type='int',
+            help='The most queries the traversal may run'),
+        make_option('--max-objects',
+            dest='max_objects',
+            default=None,
+            type='int',
+            help='The most objects the traversal may collect'),
+        make_option('--max-seconds',
+            dest='max_seconds',
+            default=None,
+            type='float',
+            help='The most seconds the traversal may take'),
+        make_option('--on-budget',
+            dest='on_budget',
+            default='abort',
+            type='choice',
+            choices=['abort', 'cut'],
+            help='When the traversal goes over --max-queries, --max-objects '
+                 'or --max-seconds, abort the dump or cut it at the current '
+                 'level. Defaults to "abort".'),
+        make_option('--workers',
+            dest='workers',
+            default=1,
+            type='int',
+            help='Traverse the related objects of the root objects with this '
+                 'many processes'),
+        make_option('--concurrency',
+            dest='concurrency',
+            default=1,
+            type='int',
+            help='Run this many of the relation queries of each level at the '
+                 'same time, on separate threads and database connections'),
+        make_option('--checkpoint',
+            dest='checkpoint',
+            default=None,
+            help='Save the progress of the dump to this SQLite file, so it '
+                 'can be resumed with --resume'),
+        make_option('--resume',
+            dest='resume',
+            default=None,
+            help='Resume the dump saved in this checkpoint file, and keep '
+                 'saving its progress there'),
+        make_option('--snapshot',
+            dest='snapshot',
+            default=None,
+            help='Save the graph of the dump to this SQLite file, for later '
+                 'dumps with --since'),
+        make_option('--since',
+            dest='since',
+            default=None,
+            help='Only dump the objects changed since this date and time, '
+                 'or that were not in the --snapshot of the previous dump'),
+        make_option('--manifest',
+            dest='manifest',
+            default=None,
+            help='With --since, write the keys of the objects that are not '
+                 'part of the dump anymore to this JSON file'),
+        make_option('--cache',
+            dest='cache',
+            default=None,
+            help='Keep the relations found for each object in this SQLite '
+                 'file and reuse them while the related models are unchanged'),
+        make_option('--cache-size',
+            dest='cache_size',
+            default=1000000,
+            type='int',
+            help='The number of relations kept in the --cache file, the least '
+                 'recently used are removed first'),
+        make_option('--stats',
+            action='store_true',
+            dest='stats',
+            default=False,
+            help='Report the time, queries and objects of each step of the '
+                 'dump on stderr'),
+        make_option('--stats-file',
+            dest='stats_file',
+            default=None,
+            help='Write the --stats report to this JSON file instead'),
         make_option('--limit',
             dest='limit',
             default=None,
@@ -98,15 +232,150 @@ class Command(BaseCommand):
             default=None,
             type="str",
             help='Output a GraphViz (.dot) diagram of the object dependencies to the passed filepath.'),
+        make_option('--chunk-size',
+            dest='chunk_size',
+            default=None,
+            type='int',
+            help='Number of objects fetched, written and released at a time '
+                 'while serializing. Defaults to the BATCH_SIZE setting.'),
+        make_option('--fast',
+            action='store_true',
+            dest='fast',
+            default=False,
+            help='Serialize straight from database rows instead of model '
+                 'instances. Only for the json and jsonl formats, and other '
+                 'formats that write fields like the python serializer, '
+                 'without natural keys.'),
+        make_option('-o', '--output',
+            dest='output',
+            default=None,
+            help='Write the fixture to this file instead of stdout. Files '
+                 'ending in .gz, .bz2, .xz or .zst are compressed.'),
     )
 
-    def process_additional_relations(self, obj, limit=None):
-        key = ".".join([obj._meta.app_label, obj._meta.model_name])
-        addl_relations = MODEL_SETTINGS.get(key, {}).get('addl_relations', [])
+    using = DEFAULT_DB_ALIAS
+    use_obj_key = True
+    verbose = False
+    obj_filter = None
+    concurrency = 1
+    pool = None
+    thread_connections = None  # the connections opened by the pool threads
+    checkpoint = None
+    journal = None  # {table: rows} of the graph not saved to the checkpoint yet
+    cache = None
+    recording = None
+    stats = None
+    hooks = False  # whether the signals have receivers
+    budget = None
+    on_budget = 'abort'
+    truncated = None  # {(model key, relation): objects} not followed
+    max_depth = None  # --depth, before the budget lowers it
+    checkpoint_interval = 60  # seconds
+    resumable = False
+
+    def add_relation(self, node, field_name, rel_node, depends=True):
+        """
+        Record that the object of ``node`` generates the object of
+        ``rel_node`` through ``field_name``.
+
+        If ``depends`` is ``True``, ``node`` also depends on ``rel_node`` and
+        must be serialized after it.
+        """
+        if depends:
+            self.depends_on[node].add(rel_node)
+            self.relationships[node][field_name].add(rel_node)
+        self.generates[node].add(rel_node)
+        if self.journal is not None:
+            if depends:
+                self.journal['depends_on'].append((node, rel_node))
+                self.journal['relationships'].append((node, field_name, rel_node))
+            self.journal['generates'].append((node, rel_node))
+        if self.recording:
+            edges = self.recording.get(node)
+            if edges is not None:
+                edges.append((field_name, rel_node, depends))
+        if self.verbose:
+            self.write_debug("%s.%s -> %s" % (
+                get_node_key(node, include_pk=self.use_obj_key), field_name,
+                get_node_key(rel_node, include_pk=self.use_obj_key)))
+
+    def write_debug(self, value):
+        """
+        Pretty-print ``value`` on its own line of stderr
+        """
+        self.stderr.write(pprint.pformat(value))
+
+    def format_graph(self, graph):
+        """
+        Convert a graph of nodes to the same graph of ``get_key`` strings
+        """
+        def fmt(node):
+            return get_node_key(node, include_pk=self.use_obj_key)
+        output = {}
+        for node, edges in graph.items():
+            if isinstance(edges, dict):
+                fields = output.setdefault(fmt(node), defaultdict(set))
+                for field, rel_nodes in edges.items():
+                    fields[field].update(fmt(n) for n in rel_nodes)
+            else:
+                output.setdefault(fmt(node), set()).update(fmt(n) for n in edges)
+        return output
+
+    def get_related_objects(self, obj, rel, limit=None):
+        """
+        Fetch the objects of an arbitrary relation attribute of a single
+        object. Used for relation names that can't be fetched in bulk.
+        """
+        try:
+            related_objs = obj.__getattribute__(rel)
+            # handle OneToOneField case for related object
+            if isinstance(related_objs, models.Model):
+                related_objs = [related_objs]
+            else:  # everything else uses a related manager
+                related_objs = related_objs.all()
+
+            if limit:
+                related_objs = related_objs[:limit]
+            return list(related_objs)
+        except (FieldError, ObjectDoesNotExist):
+            return []
+
+    def get_plan(self, model):
+        """
+        Return the ``RelationPlan`` of ``model``, building it the first time
+        the model is seen. Relations to models filtered out by the current
+        ``ObjectFilter`` are pruned from it.
+        """
+        try:
+            return self.plans[model]
+        except KeyError:
+            self.plans[model] = RelationPlan(model, self.obj_filter)
+            return self.plans[model]
+
+    def process_additional_relations(self, objs, limit=None):
+        if not objs:
+            return []
         output = []
-        obj_key = get_key(obj, include_pk=self.use_obj_key)
-        add_dependency = False
-        for rel in addl_relations:
+        for obj in objs:
+            node = get_node(obj)
+            for rel, rel_obj, add_dependency in self.iter_additional_relations(obj):
+                rel_node = get_node(rel_obj)
+                if add_dependency:
+                    self.depends_on[rel_node].add(node)
+                    self.relationships[node][rel.__name__].add(rel_node)
+                    if self.journal is not None:
+                        self.journal['depends_on'].append((rel_node, node))
+                        self.journal['relationships'].append((node, rel.__name__, rel_node))
+                self.add_relation(node, rel, rel_node, depends=False)
+                output.append(rel_obj)
+        return output
+
+    def iter_additional_relations(self, obj):
+        """
+        Yield ``(relation, related object, depends on obj)`` for the
+        ``addl_relations`` of ``obj``
+        """
+        for rel in self.get_plan(obj.__class__).additional_relations:
             if callable(rel):
                 rel_objs = rel(obj)
                 add_dependency = getattr(rel, 'depends_on_obj', False)
@@ -118,200 +387,742 @@ class Command(BaseCommand):
             if not isinstance(rel_objs, Iterable):
                 rel_objs = [rel_objs]
             for rel_obj in rel_objs:
-                rel_key = get_key(rel_obj, include_pk=self.use_obj_key)
-                if add_dependency:
-                    self.depends_on[rel_obj].add(obj)
-                    self.relationships[obj_key][rel.__name__].add(rel_key)
-                self.generates[obj_key].add(rel_key)
-                if self.verbose:
-                    pprint.pprint("%s.%s -> %s" % (obj_key, rel, rel_key),
-                        stream=self.stderr)
-                output.append(rel_obj)
-        return output
+                yield rel, rel_obj, add_dependency
+
+    def related_fetches(self, objs, limit=None):
+        """
+        Return the queries following the reverse relations, many-to-many
+        fields and generic relations of a batch of objects of the same model,
+        as ``(add, relation name, fetch, args)``. ``fetch(*args)`` gets the
+        related objects and ``add(relation name, result, obj_filter)`` adds
+        them to the graph.
+
+        The fetches only read the graph, so those of a level can run at the
+        same time. Reverse foreign keys, many-to-many and generic relations
+        are fetched for the whole batch with one query per relation, or two
+        for many-to-many, and ``limit`` is applied to each object of the
+        batch separately.
+        """
+        if not objs:
+            return []
+        plan = self.get_plan(objs[0].__class__)
+        fetches = []
+        for rel, field in plan.reverse_relations:
+            if field is None:
+                fetches.append((self.add_reverse, rel, self.fetch_related_objects, (objs, rel, limit)))
+            else:
+                fetches.append((self.add_reverse, rel, self.fetch_reverse_foreignkey, (objs, field, limit)))
+        for rel, field in plan.many_to_many:
+            if field is None:
+                fetches.append((self.add_many2many, rel, self.fetch_related_links, (objs, rel, limit)))
+            else:
+                fetches.append((self.add_many2many, rel, self.fetch_many2many, (objs, field, limit)))
+        for field in plan.generic_relations:
+            fetches.append((self.add_reverse, field.name, self.fetch_generic_relation, (objs, field, limit)))
+        return fetches
+
+    def run_fetches(self, fetches):
+        """
+        Yield the results of ``fetches`` in order. With a thread pool they
+        run concurrently, ``concurrency`` at a time.
+        """
+        if self.pool is None:
+            for fetch in fetches:
+                yield self.run_fetch(fetch)
+        else:
+            for result in self.pool.imap(self.run_fetch, fetches):
+                yield result
+
+    def run_fetch(self, fetch):
+        """
+        Run one of the ``(add, relation name, fetch, args)`` fetches of
+        ``related_fetches``
+        """
+        add, rel, func, args = fetch
+        if self.budget is not None and self.budget.reason is not None:
+            # The level was cut while the fetch was queued in the pool
+            return None
+        # The queries of the pool threads are counted by their own thread,
+        # the budget only takes them from the connection of the caller
+        count_queries = False
+        if self.thread_connections is not None:
+            connection = connections[self.using]
+            if connection not in self.thread_connections:
+                # Closed by the main thread once the traversal is done
+                connection.allow_thread_sharing = True
+                self.thread_connections.add(connection)
+            count_queries = (self.budget is not None and self.budget.max_queries is not None and
+                             self.stats is None)
+            if count_queries:
+                self.budget.count_queries()
+        try:
+            if not self.measured:
+                return func(*args)
+            start = self.begin()
+            result = func(*args)
+            self.fetched(args[0][0].__class__, rel, start, len(result))
+            return result
+        finally:
+            if count_queries:
+                self.budget.count_queries()
+
+    @property
+    def measured(self):
+        return self.stats is not None or self.hooks
 
-    def process_related_fields(self, obj, limit=None, obj_filter=None):
-        related_fields = get_reverse_relations(obj)
+    def begin(self):
+        """
+        Start measuring a step for ``--stats`` and the signals
+        """
+        if self.stats is not None:
+            return self.stats.begin()
+        return time.time()
+
+    def fetched(self, model, relation, start, objects):
+        """
+        Record the batch fetch of ``relation`` of ``model``, measured since
+        ``start``, that got ``objects`` rows
+        """
+        if self.stats is not None:
+            self.stats.end(model, relation, start)
+        if self.hooks:
+            signals.relation_fetched.send(
+                sender=self.__class__, model=model, relation=relation,
+                objects=objects, seconds=time.time() - start)
+
+    def flushed(self, model, start, objects):
+        """
+        Record the writing of a chunk of ``objects`` of ``model``, measured
+        since ``start``
+        """
+        if self.stats is not None:
+            self.stats.end(model, "(serialization)", start, objects)
+        if self.hooks:
+            signals.chunk_flushed.send(
+                sender=self.__class__, model=model, objects=objects,
+                seconds=time.time() - start)
+
+    def add_reverse(self, rel, pairs, obj_filter=None):
+        """
+        Add the ``(obj, rel_obj)`` pairs of a reverse relation to the graph.
+        Returns the related objects to traverse.
+        """
         output = []
-        obj_key = get_key(obj, include_pk=self.use_obj_key)
-        key = ".".join([obj._meta.app_label, obj._meta.model_name])
-        m2m_fields = MODEL_SETTINGS.get(key, {}).get('reverse_relations', related_fields)
-        # m2m_fields could be True for all, False for none, or an iterable for
-        # some of the m2m_fields
-        if m2m_fields is True:
-            m2m_fields = related_fields
-        elif m2m_fields is False:
-            m2m_fields = []
-        for rel in m2m_fields:
-            try:
-                related_objs = obj.__getattribute__(rel)
-                # handle OneToOneField case for related object
-                if isinstance(related_objs, models.Model):
-                    related_objs = [related_objs]
-                else:  # everything else uses a related manager
-                    related_objs = related_objs.all()
+        for obj, rel_obj in pairs:
+            if obj_filter is not None and obj_filter.skip(rel_obj):
+                continue
+            self.add_relation(get_node(obj), rel, get_node(rel_obj), depends=False)
+            output.append(rel_obj)
+        return output
+
+    def fetch_related_objects(self, objs, rel, limit=None):
+        return [(obj, rel_obj) for obj in objs
+                for rel_obj in self.get_related_objects(obj, rel, limit)]
+
+    def fetch_reverse_foreignkey(self, objs, field, limit=None):
+        """
+        Return ``(obj, rel_obj)`` pairs for every object pointing at one of
+        ``objs`` through the foreign key ``field``.
 
+        With a ``limit``, only the first ``limit`` related objects of each
+        object are returned, in the same order as ``obj.<related>_set.all()``
+        """
+        target_attname = field.rel.get_related_field().attname
+        by_value = defaultdict(list)
+        for obj in objs:
+            value = getattr(obj, target_attname)
+            if value is not None:
+                by_value[value].append(obj)
+        pairs = []
+        counts = defaultdict(int)
+        queryset = field.model._default_manager.using(self.using)
+        if limit:
+            queryset = queryset.order_by(*get_ordering(field.model))
+        lookup = "%s__in" % field.name
+        for values in chunked(by_value.keys()):
+            for rel_obj in queryset.filter(**{lookup: values}).iterator():
+                value = getattr(rel_obj, field.attname)
                 if limit:
-                    related_objs = related_objs[:limit]
-                for rel_obj in related_objs:
-                    if obj_filter is not None and obj_filter.skip(rel_obj):
+                    if counts[value] >= limit:
                         continue
-                    rel_key = get_key(rel_obj, include_pk=self.use_obj_key)
-                    self.generates[obj_key].add(rel_key)
-                    if self.verbose:
-                        pprint.pprint("%s.%s -> %s" % (obj_key, rel, rel_key),
-                                      stream=self.stderr)
-                    output.append(rel_obj)
-            except (FieldError, ObjectDoesNotExist):
-                pass
-        return output
+                    counts[value] += 1
+                for obj in by_value[value]:
+                    pairs.append((obj, rel_obj))
+        return pairs
 
-    def process_many2many(self, obj, limit=None, obj_filter=None):
+    def add_many2many(self, rel, links, obj_filter=None):
+        """
+        Add the ``(obj, rel_node, rel_obj)`` links of a many-to-many field to
+        the graph. Returns the related objects to traverse.
+        """
         output = []
-        obj_key = get_key(obj, include_pk=self.use_obj_key)
-        key = ".".join([obj._meta.app_label, obj._meta.model_name])
-        related_fields = get_many_to_many(obj)
-        m2m_fields = MODEL_SETTINGS.get(key, {}).get('m2m_fields', related_fields)
-
-        # m2m_fields could be True for all, False for none, or an iterable for
-        # some of the m2m_fields
-        if m2m_fields is True:
-            m2m_fields = related_fields
-        elif m2m_fields is False:
-            m2m_fields = []
-        for rel in m2m_fields:
-            try:
-                related_objs = obj.__getattribute__(rel)
-                related_objs = related_objs.all()
+        for obj, rel_node, rel_obj in links:
+            if rel_obj is None:
+                # Already traversed, only the relation is new
+                if not self.priors[rel_node]:
+                    continue
+            elif obj_filter is not None and obj_filter.skip(rel_obj):
+                continue
+            else:
+                output.append(rel_obj)
+            self.add_relation(get_node(obj), rel, rel_node)
+        return output
+
+    def fetch_related_links(self, objs, rel, limit=None):
+        return [(obj, get_node(rel_obj), rel_obj) for obj in objs
+                for rel_obj in self.get_related_objects(obj, rel, limit)]
 
+    def fetch_many2many(self, objs, field, limit=None):
+        """
+        Return ``(obj, rel_node, rel_obj)`` for every object related to one
+        of ``objs`` through the many-to-many ``field``. Related objects that
+        were already traversed aren't fetched again and are ``None``.
+
+        With a ``limit``, only the first ``limit`` related objects of each
+        object are returned, in the same order as ``obj.<field>.all()``
+        """
+        through = field.rel.through
+        target_name = field.m2m_reverse_field_name()
+        source_attname = through._meta.get_field(field.m2m_field_name()).attname
+        target_attname = through._meta.get_field(target_name).attname
+        objs_by_pk = defaultdict(list)
+        for obj in objs:
+            objs_by_pk[obj.pk].append(obj)
+        links = []
+        counts = defaultdict(int)
+        through_qs = through._default_manager.using(self.using)
+        if limit:
+            through_qs = through_qs.order_by(*get_ordering(field.rel.to, target_name))
+        for pks in chunked(objs_by_pk.keys()):
+            rows = through_qs.filter(
+                **{"%s__in" % source_attname: pks}).values_list(source_attname, target_attname)
+            for source_pk, target_pk in rows:
                 if limit:
-                    related_objs = related_objs[:limit]
-                for rel_obj in related_objs:
-                    if obj_filter is not None and obj_filter.skip(rel_obj):
+                    if counts[source_pk] >= limit:
                         continue
-                    rel_key = get_key(rel_obj, include_pk=self.use_obj_key)
-                    self.depends_on[obj].add(rel_obj)
-                    self.relationships[obj_key][rel].add(rel_key)
-                    self.generates[obj_key].add(rel_key)
-                    if self.verbose:
-                        pprint.pprint("%s.%s -> %s" % (obj_key, rel, rel_key),
-                                      stream=self.stderr)
-                    output.append(rel_obj)
-            except (FieldError, ObjectDoesNotExist):
-                pass
+                    counts[source_pk] += 1
+                links.append((source_pk, target_pk))
+        ct_id = get_content_type_id(field.rel.to)
+        targets = {}
+        manager = field.rel.to._default_manager.using(self.using)
+        missing = set(target_pk for _, target_pk in links
+                      if (ct_id, target_pk) not in self.priors)
+        for pks in chunked(missing):
+            targets.update(manager.in_bulk(pks))
+        output = []
+        for source_pk, target_pk in links:
+            if target_pk in missing and target_pk not in targets:
+                continue
+            for obj in objs_by_pk[source_pk]:
+                output.append((obj, (ct_id, target_pk), targets.get(target_pk)))
         return output
 
-    def process_foreignkeys(self, obj, obj_filter=None):
+    def process_foreignkeys(self, objs, obj_filter=None, known=None):
+        """
+        Follow the foreign keys of one level of objects.
+
+        The raw ``attname`` values of all the objects are collected first and
+        the related objects are loaded with one ``in_bulk`` per related model.
+        Objects that were already traversed, or that are in the ``known``
+        dict of ``{node: obj}``, are never fetched again.
+        """
         output = []
-        obj_key = get_key(obj, include_pk=self.use_obj_key)
-        key = ".".join([obj._meta.app_label, obj._meta.model_name])
-        all_field_names = obj._meta.get_all_field_names()
-        fk_fields = MODEL_SETTINGS.get(key, {}).get('fk_fields', all_field_names)
-        # fk_fields could be True for all, False for none, or an iterable for
-        # some of the m2m_fields
-        if fk_fields is True:
-            fk_fields = all_field_names
-        elif fk_fields is False:
-            fk_fields = []
-        for field in obj._meta.fields:
-            if isinstance(field, ForeignKey) and field.name in fk_fields:
-                try:
-                    fk_obj = obj.__getattribute__(field.name)
-                    if fk_obj and obj_filter is not None and not obj_filter.skip(fk_obj):
-                        fk_key = get_key(fk_obj, include_pk=self.use_obj_key)
-                        self.depends_on[obj].add(fk_obj)
-                        self.relationships[obj_key][field.name].add(fk_key)
-                        self.generates[obj_key].add(fk_key)
-                        if self.verbose:
-                            pprint.pprint("%s.%s -> %s" % (obj_key, field.name, fk_key),
-                                          stream=self.stderr)
-                        output.append(fk_obj)
-                except TypeError as e:
-                    print "Error processing FK:", e, obj, field.name
+        if known is None:
+            known = {}
+        links = []  # [(node, field name, fk node, fk obj)]
+        # {(related model, related attname): {value: [(node, field name)]}}
+        wanted = defaultdict(lambda: defaultdict(list))
+        for model, model_objs in group_by_model(objs):
+            for field in self.get_plan(model).foreign_keys:
+                cache_name = field.get_cache_name()
+                target = (field.rel.to._meta.concrete_model,
+                          field.rel.get_related_field().attname)
+                for obj in model_objs:
+                    if cache_name in obj.__dict__:
+                        fk_obj = obj.__dict__[cache_name]
+                        if fk_obj is not None:
+                            links.append((get_node(obj), field.name, get_node(fk_obj), fk_obj))
+                        continue
+                    value = getattr(obj, field.attname)
+                    if value is not None:
+                        wanted[target][value].append((get_node(obj), field.name))
+
+        for (rel_model, rel_attname), referrers in wanted.items():
+            ct_id = get_content_type_id(rel_model)
+            is_pk = rel_attname == rel_model._meta.pk.attname
+            fetched = {}
+            missing = []
+            for value in referrers:
+                if is_pk and (ct_id, value) in self.priors:
+                    fetched[value] = None
+                elif is_pk and (ct_id, value) in known:
+                    fetched[value] = known[(ct_id, value)]
+                else:
+                    missing.append(value)
+            manager = rel_model._base_manager.using(self.using)
+            if self.measured:
+                start, before = self.begin(), len(fetched)
+            for values in chunked(missing):
+                if is_pk:
+                    fetched.update(manager.in_bulk(values))
+                else:
+                    fetched.update(
+                        (getattr(rel_obj, rel_attname), rel_obj)
+                        for rel_obj in manager.filter(**{"%s__in" % rel_attname: values}))
+            if self.measured:
+                self.fetched(rel_model, "(foreign keys)", start, len(fetched) - before)
+            for value, referring in referrers.items():
+                if value not in fetched:
+                    continue
+                fk_obj = fetched[value]
+                fk_node = (ct_id, value) if fk_obj is None else get_node(fk_obj)
+                links.extend((node, field_name, fk_node, fk_obj) for node, field_name in referring)
+
+        queued = set()
+        for node, field_name, fk_node, fk_obj in links:
+            if fk_node in self.priors:
+                # Already traversed, only the relation is new
+                if not self.priors[fk_node]:
+                    continue
+            elif obj_filter is not None and obj_filter.skip(fk_obj):
+                continue
+            elif fk_node not in known and fk_node not in queued:
+                queued.add(fk_node)
+                output.append(fk_obj)
+            self.add_relation(node, field_name, fk_node)
+        if self.stats is not None:
+            for model, model_objs in group_by_model(output):
+                self.stats.add_objects(model, "(foreign keys)", len(model_objs))
         return output
 
-    def process_genericforeignkeys(self, obj, obj_filter=None):
+    def process_genericforeignkeys(self, objs, obj_filter=None, known=None):
+        """
+        Follow the generic foreign keys of one level of objects.
+
+        The ``(content_type_id, object_id)`` pairs of all the objects are
+        collected first and the related objects are loaded with one
+        ``in_bulk`` per content type, like ``process_foreignkeys``.
+        """
         output = []
-        obj_key = get_key(obj, include_pk=self.use_obj_key)
-        key = ".".join([obj._meta.app_label, obj._meta.model_name])
-        all_field_names = [x.name for x in obj._meta.virtual_fields]
-        gfk_fields = MODEL_SETTINGS.get(key, {}).get('gfk_fields', all_field_names)
-        if gfk_fields is True:
-            gfk_fields = all_field_names
-        elif gfk_fields is False:
-            gfk_fields = []
-        for field in obj._meta.virtual_fields:
-            if field.name in gfk_fields:
-                try:
-                    gfk_obj = obj.__getattribute__(field.name).model
-                    if gfk_obj and obj_filter is not None and not obj_filter.skip(gfk_obj):
-                        gfk_key = get_key(gfk_obj, include_pk=self.use_obj_key)
-                        self.depends_on[obj].add(gfk_obj)
-                        self.relationships[obj_key][field.name].add(gfk_key)
-                        self.generates[obj_key].add(gfk_key)
-                        if self.verbose:
-                            pprint.pprint("%s.%s -> %s" % (obj_key, field.name, gfk_key),
-                                          stream=self.stderr)
-                        output.append(gfk_obj)
-                except TypeError:
-                    print "Error getting GFK %s" % field.name
+        if known is None:
+            known = {}
+        links = []  # [(node, field name, gfk node, gfk obj)]
+        wanted = defaultdict(lambda: defaultdict(list))  # {ct id: {object id: [(node, field name)]}}
+        for model, model_objs in group_by_model(objs):
+            for field in self.get_plan(model).generic_foreign_keys:
+                ct_attname = model._meta.get_field(field.ct_field).attname
+                for obj in model_objs:
+                    if field.cache_attr in obj.__dict__:
+                        gfk_obj = obj.__dict__[field.cache_attr]
+                        if gfk_obj is not None:
+                            links.append((get_node(obj), field.name, get_node(gfk_obj), gfk_obj))
+                        continue
+                    ct_id = getattr(obj, ct_attname)
+                    object_id = getattr(obj, field.fk_field)
+                    if ct_id is not None and object_id is not None:
+                        wanted[ct_id][object_id].append((get_node(obj), field.name))
+
+        # The content type ids of the rows are those of the dumped database
+        content_types = ContentType.objects.db_manager(self.using)
+        warm_content_types(wanted.keys(), self.using)
+        for ct_id, referrers in wanted.items():
+            rel_model = content_types.get_for_id(ct_id).model_class()
+            if rel_model is None:
+                continue
+            rel_model = rel_model._meta.concrete_model
+            if obj_filter is not None and obj_filter.skip_model(rel_model):
+                continue
+            node_ct_id = get_content_type_id(rel_model)
+            to_python = rel_model._meta.pk.to_python
+            fetched = {}
+            missing = []
+            for object_id in referrers:
+                rel_node = (node_ct_id, to_python(object_id))
+                if rel_node in self.priors:
+                    fetched[object_id] = None
+                elif rel_node in known:
+                    fetched[object_id] = known[rel_node]
+                else:
+                    missing.append(object_id)
+            manager = rel_model._base_manager.using(self.using)
+            if self.measured:
+                start, before = self.begin(), len(fetched)
+            for object_ids in chunked(missing):
+                found = manager.in_bulk([to_python(object_id) for object_id in object_ids])
+                for object_id in object_ids:
+                    if to_python(object_id) in found:
+                        fetched[object_id] = found[to_python(object_id)]
+            if self.measured:
+                self.fetched(rel_model, "(generic foreign keys)", start, len(fetched) - before)
+            for object_id, referring in referrers.items():
+                if object_id not in fetched:
+                    continue
+                gfk_obj = fetched[object_id]
+                gfk_node = (node_ct_id, to_python(object_id)) if gfk_obj is None else get_node(gfk_obj)
+                links.extend((node, field_name, gfk_node, gfk_obj) for node, field_name in referring)
+
+        queued = set()
+        for node, field_name, gfk_node, gfk_obj in links:
+            if gfk_node in self.priors:
+                # Already traversed, only the relation is new
+                if not self.priors[gfk_node]:
+                    continue
+            elif obj_filter is not None and obj_filter.skip(gfk_obj):
+                continue
+            elif gfk_node not in known and gfk_node not in queued:
+                queued.add(gfk_node)
+                output.append(gfk_obj)
+            self.add_relation(node, field_name, gfk_node)
+        if self.stats is not None:
+            for model, model_objs in group_by_model(output):
+                self.stats.add_objects(model, "(generic foreign keys)", len(model_objs))
         return output
 
+    def fetch_generic_relation(self, objs, field, limit=None):
+        """
+        Return ``(obj, rel_obj)`` pairs for every object pointing at one of
+        ``objs`` through the ``GenericRelation`` ``field``
+        """
+        model = objs[0].__class__
+        ct = ContentType.objects.db_manager(self.using).get_for_model(
+            model, for_concrete_model=field.for_concrete_model)
+        to_python = model._meta.pk.to_python
+        objs_by_pk = defaultdict(list)
+        for obj in objs:
+            objs_by_pk[obj.pk].append(obj)
+        pairs = []
+        counts = defaultdict(int)
+        rel_model = field.rel.to
+        queryset = rel_model._default_manager.using(self.using).filter(
+            **{field.content_type_field_name: ct})
+        if limit:
+            queryset = queryset.order_by(*get_ordering(rel_model))
+        lookup = "%s__in" % field.object_id_field_name
+        for pks in chunked(objs_by_pk.keys()):
+            for rel_obj in queryset.filter(**{lookup: pks}).iterator():
+                pk = to_python(getattr(rel_obj, field.object_id_field_name))
+                if limit:
+                    if counts[pk] >= limit:
+                        continue
+                    counts[pk] += 1
+                for obj in objs_by_pk[pk]:
+                    pairs.append((obj, rel_obj))
+        return pairs
+
     def process_object(self, obj, obj_filter=None):
+        """
+        Register ``obj`` for serialization. Returns the object to traverse,
+        or ``None`` if it was already seen or is filtered out.
+        """
         # Abort cyclic references.
-        if obj._meta.proxy:
-            obj = obj._meta.proxy_for_model.objects.get(pk=obj.pk)
+        if isinstance(obj, tuple):
+            node, model = obj, get_node_model(obj)
+        else:
+            node, model = get_node(obj), obj.__class__
+        if node in self.priors:
+            return None
+        self.priors[node] = False
 
-        if obj in self.priors:
-            return
-        self.priors.add(obj)
+        if obj_filter is not None and obj_filter.skip_model(model):
+            if self.journal is not None:
+                self.journal['priors'].append((node, False))
+            return None
+
+        self.priors[node] = True
+        if self.journal is not None:
+            self.journal['priors'].append((node, True))
+        if node not in self.depends_on:
+            self.depends_on[node] = set()
+            if self.journal is not None:
+                self.journal['depends_on'].append((node, None))
+        return obj
+
+    def queue_nodes(self):
+        return [obj if isinstance(obj, tuple) else get_node(obj) for obj in self.queue]
 
-        if obj_filter is not None and obj_filter.skip(obj):
+    def save_checkpoint(self, depth, force=False):
+        """
+        Save the traversal before the level ``depth`` to the checkpoint, at
+        most once every ``checkpoint_interval`` seconds unless ``force``
+        """
+        if self.checkpoint is None:
             return
+        now = time.time()
+        if force or now - self.checkpoint_time >= self.checkpoint_interval:
+            if self.journal is None:
+                self.checkpoint.save_traversal(self, depth)
+            else:
+                self.checkpoint.add_traversal(self.journal, self.queue_nodes(), depth)
+            self.journal = defaultdict(list)
+            self.checkpoint_time = now
+
+    def chunk_written(self, nodes):
+        """
+        Record that the objects of ``nodes`` were written, saving them to
+        the checkpoint at most once every ``checkpoint_interval`` seconds
+        """
+        self.written.extend(nodes)
+        now = time.time()
+        if now - self.checkpoint_time >= self.checkpoint_interval:
+            self.checkpoint.add_emitted(self.written, self.output.sync())
+            self.written = []
+            self.checkpoint_time = now
+
+    def track_chunks(self, chunks):
+        """
+        Yield the ``(model, pks)`` chunks, recording each one as written
+        once the serializer asks for the next one
+        """
+        for model, pks in chunks:
+            if self.measured:
+                start = self.begin()
+            yield model, pks
+            if self.measured:
+                self.flushed(model, start, len(pks))
+            if self.resumable:
+                ct_id = get_content_type_id(model)
+                self.chunk_written([(ct_id, pk) for pk in pks])
+
+    def resolve_proxies(self, objs):
+        """
+        Replace the instances of proxy models in ``objs`` by instances of
+        their concrete model. Those are built from the loaded field values;
+        only instances with deferred fields are fetched again, with one
+        ``in_bulk`` per model.
+        """
+        output = []
+        missing = defaultdict(dict)  # {concrete model: {pk: position}}
+        for obj in objs:
+            if not isinstance(obj, tuple) and obj._meta.proxy:
+                concrete = get_concrete(obj)
+                if concrete is None:
+                    missing[obj._meta.concrete_model][obj.pk] = len(output)
+                    output.append(None)
+                    continue
+                obj = concrete
+            output.append(obj)
+        for model, positions in missing.items():
+            manager = model._base_manager.using(self.using)
+            for pks in chunked(positions.keys()):
+                for pk, obj in manager.in_bulk(pks).items():
+                    output[positions[pk]] = obj
+        return [obj for obj in output if obj is not None]
+
+    def process_level(self, objs, depth, obj_filter=None, limit=None, max_depth=None):
+        """
+        Follow every relation of one level of the traversal, one model at a
+        time. Returns the objects of the next level.
+        """
+        next_level = []
+        if self.cache is not None:
+            objs, next_level = self.use_cache(objs, depth, max_depth)
+        groups = group_by_model(objs)
+        if max_depth is None or depth <= max_depth:
+            fetches = []
+            for model, model_objs in groups:
+                fetches.extend(self.related_fetches(model_objs, limit))
+            done = 0
+            for (add, rel, fetch, args), result in zip(fetches, self.run_fetches(fetches)):
+                found = add(rel, result, obj_filter)
+                if self.stats is not None:
+                    self.stats.add_objects(args[0][0].__class__, rel, len(found))
+                next_level.extend(found)
+                done += 1
+                if self.over_budget(len(next_level)):
+                    break
+            for add, rel, fetch, args in fetches[done:]:
+                self.truncate(args[0][0].__class__, rel, len(args[0]))
+        elif (self.budget is not None and self.budget.reason is not None and
+                (self.max_depth is None or depth <= self.max_depth)):
+            # Past --depth, the relations wouldn't be followed anyway
+            for model, model_objs in groups:
+                for rel in sorted(self.get_plan(model).depth_limited()):
+                    self.truncate(model, rel, len(model_objs))
+        for model, model_objs in groups:
+            if not self.measured:
+                next_level.extend(self.process_additional_relations(model_objs))
+                continue
+            start = self.begin()
+            found = self.process_additional_relations(model_objs)
+            self.fetched(model, "(additional relations)", start, len(found))
+            if self.stats is not None:
+                self.stats.add_objects(model, "(additional relations)", len(found))
+            next_level.extend(found)
+        known = dict((get_node(o), o) for o in next_level if not isinstance(o, tuple))
+        for process in (self.process_foreignkeys, self.process_genericforeignkeys):
+            found = process(objs, obj_filter, known)
+            known.update((get_node(o), o) for o in found)
+            next_level.extend(found)
+        if self.cache is not None:
+            if self.budget is not None and self.budget.reason is not None:
+                # Not every relation of the level was followed
+                self.recording = None
+            else:
+                self.save_recording()
+        return next_level
+
+    def use_cache(self, objs, depth, max_depth=None):
+        """
+        Add the cached relations of the objects, or nodes, of ``objs`` to
+        the graph. Returns the objects whose relations weren't cached, with
+        the nodes among them fetched, and the nodes the cached relations
+        lead to.
+
+        The relations of the objects that weren't cached are recorded by
+        ``add_relation``, to be saved by ``save_recording``.
+        """
+        full = max_depth is None or depth <= max_depth
+        self.recording = {}
+        by_node = dict((obj if isinstance(obj, tuple) else get_node(obj), obj) for obj in objs)
+        by_ct = defaultdict(list)
+        for node in by_node:
+            by_ct[node[0]].append(node)
+        missed = []
+        output = []
+        queued = set()
+        for ct_id, nodes in by_ct.items():
+            plan = self.get_plan(get_node_model(nodes[0]))
+            stamp = self.cache.get_stamp(plan)
+            if stamp is None:
+                missed.extend(nodes)
+                continue
+            found = self.cache.get(nodes, stamp)
+            depth_limited = plan.depth_limited()
+            for node in nodes:
+                if node not in found:
+                    missed.append(node)
+                    if full:
+                        self.recording[node] = []
+                    continue
+                for field_name, rel_node, depends in found[node]:
+                    if not full and field_name in depth_limited:
+                        continue
+                    self.add_relation(node, field_name, rel_node, depends)
+                    if rel_node not in self.priors and rel_node not in queued:
+                        queued.add(rel_node)
+                        output.append(rel_node)
+        missed_objs = [by_node[node] for node in missed if not isinstance(by_node[node], tuple)]
+        missed_objs.extend(hydrate(
+            [node for node in missed if isinstance(by_node[node], tuple)], self.using))
+        return missed_objs, output
 
-        obj_key = get_key(obj, include_pk=self.use_obj_key)
-        self.to_serialize.append(obj)
-        if obj not in self.depends_on:
-            self.depends_on[obj] = set()
-        return obj_key
+    def save_recording(self):
+        """
+        Save the relations recorded since ``use_cache`` to the cache
+        """
+        by_ct = defaultdict(dict)
+        for node, edges in self.recording.items():
+            by_ct[node[0]][node] = edges
+        self.recording = None
+        for ct_id, edges in by_ct.items():
+            plan = self.get_plan(get_node_model((ct_id, None)))
+            self.cache.put(edges, self.cache.get_stamp(plan))
+
+    def over_budget(self, pending=0):
+        """
+        Return whether the traversal went over its budget, with ``pending``
+        objects queued besides those in ``self.priors``. Raises
+        ``CommandError`` then, unless the dump is cut instead.
+        """
+        if self.budget is None:
+            return False
+        reason = self.budget.check(len(self.priors) + pending, self.stats)
+        if reason is None:
+            return False
+        if self.on_budget == 'abort':
+            raise CommandError("The dump went over its budget: %s." % reason)
+        return True
+
+    def truncate(self, model, relation, objects):
+        """
+        Record that ``relation`` of ``objects`` objects of ``model`` wasn't
+        followed because the dump was cut
+        """
+        self.truncated[(get_model_key(model), relation)] += objects
 
     def process_queue(self, objs, obj_filter=None, limit=None, max_depth=None):
         """
-        Generate a list of objects to serialize
+        Build the graph of objects to serialize.
+
+        The related objects are collected breadth first, one depth level at
+        a time, so each relation is fetched once per level for all the
+        objects of a model instead of once per object. The graph only holds
+        ``(content_type_id, pk)`` nodes; instances are only kept for the
+        level being traversed.
         """
-        self.depends_on = defaultdict(set)  # {key: set(keys being pointed to)}
-        self.relationships = defaultdict(lambda: defaultdict(set))  # {key: {'field': set(objs)}}
+        self.depends_on = defaultdict(set)  # {node: set(nodes being pointed to)}
+        self.relationships = defaultdict(lambda: defaultdict(set))  # {node: {'field': set(nodes)}}
         self.generates = defaultdict(set)
-        self.to_serialize = []
 
         # Recursively serialize all related objects.
-        self.priors = set()
-        _queue = list(objs)
-
-        self.queue = zip(_queue, [0] * len(_queue))  # queue is obj, depth
-        while self.queue:
-            obj, depth = self.queue.pop(0)
-            obj_key = self.process_object(obj, obj_filter)
-            if obj_key is None:
-                continue
+        self.priors = {}  # {node: True if the object is serialized}
+        depth = 0
+        saved = None
+        if self.checkpoint is not None:
+            saved = self.checkpoint.load_traversal(self)
+        if saved is None:
+            self.queue = list(objs)
+        else:
+            nodes, depth = saved
+            self.queue = list(hydrate(nodes, self.using))
+        if self.checkpoint is not None:
+            # Only what the traversal adds to the graph is saved from now on
+            self.journal = defaultdict(list)
+        self.traverse(depth, obj_filter, limit, max_depth)
 
-            if max_depth is None or depth <= max_depth:
-                rel_objs = self.process_related_fields(obj, limit, obj_filter)
-                for rel in rel_objs:
-                    self.queue.append((rel, depth + 1))
-                rel_objs = self.process_many2many(obj, limit, obj_filter)
-                for rel in rel_objs:
-                    self.queue.append((rel, depth + 1))
-            addl_rel_objs = self.process_additional_relations(obj)
-            for ar_obj in addl_rel_objs:
-                self.queue.append((ar_obj, depth + 1))
-            fk_objs = self.process_foreignkeys(obj, obj_filter)
-            for fk_obj in fk_objs:
-                self.queue.append((fk_obj, depth + 1))
-            gfk_objs = self.process_genericforeignkeys(obj, obj_filter)
-            for gfk_obj in gfk_objs:
-                self.queue.append((gfk_obj, depth + 1))
+    def traverse(self, depth=0, obj_filter=None, limit=None, max_depth=None):
+        """
+        Traverse the objects of ``self.queue`` and everything they lead to,
+        level by level, starting at ``depth``. Nodes already in
+        ``self.priors`` are not traversed again.
+        """
+        self.plans = {}  # {model: RelationPlan}
+        self.obj_filter = obj_filter
+        self.max_depth = max_depth
+        self.checkpoint_time = time.time()
+        if self.concurrency > 1:
+            # Each thread opens its own database connection, see run_fetch
+            self.pool = ThreadPool(self.concurrency)
+            self.thread_connections = set()
+        try:
+            while self.queue:
+                if self.stats is not None:
+                    self.stats.queue_size(len(self.queue))
+                if self.hooks:
+                    start = time.time()
+                    signals.level_started.send(
+                        sender=self.__class__, depth=depth, objects=len(self.queue))
+                level = []
+                for obj in self.resolve_proxies(self.queue):
+                    obj = self.process_object(obj, obj_filter)
+                    if obj is not None:
+                        level.append(obj)
+                self.queue = self.process_level(level, depth, obj_filter, limit, max_depth)
+                if self.over_budget(len(self.queue)) and (max_depth is None or depth < max_depth):
+                    # Only the foreign keys of the objects queued so far are
+                    # followed from now on, as beyond --depth
+                    max_depth = depth
+                if self.hooks:
+                    signals.level_finished.send(
+                        sender=self.__class__, depth=depth, objects=len(level),
+                        next_level=len(self.queue), seconds=time.time() - start)
+                depth += 1
+                self.save_checkpoint(depth, force=not self.queue)
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+                for connection in self.thread_connections:
+                    connection.close()
+                self.thread_connections = None
 
     def handle(self, *args, **options):
+        # --stats and the budget count the queries of the connection
+        with stop_counting_queries(connections[options.get('database')]):
+            return self.dump(*args, **options)
+
+    def dump(self, *args, **options):
         format = options.get('format')
         indent = options.get('indent')
         using = options.get('database')
@@ -324,8 +1135,49 @@ class Command(BaseCommand):
         debug = options.get("debug")
         model_diagram_file = options.get("modeldiagram")
         object_diagram_file = options.get("objdiagram")
+        chunk_size = options.get("chunk_size")
+        fast = options.get("fast")
+        if fast and use_natural_keys:
+            raise CommandError("--fast can't be used with --natural.")
+        if fast and not has_fast_path(format):
+            raise CommandError("--fast can't be used with --format %s." % format)
+        output_file = options.get("output")
+        workers = options.get("workers") or 1
+        self.concurrency = options.get("concurrency") or 1
+        checkpoint_file = options.get("checkpoint")
+        resume_file = options.get("resume")
+        snapshot_file = options.get("snapshot")
+        cache_file = options.get("cache")
+        stats_file = options.get("stats_file")
+        if workers > 1:
+            unsupported = [option for option, value in (
+                ("--cache", cache_file), ("--stats", options.get("stats") or stats_file),
+                ("--since", options.get("since"))) if value]
+            if unsupported:
+                raise CommandError("%s can't be used with --workers." % ", ".join(unsupported))
+        if options.get("stats") or stats_file:
+            self.stats = Stats(using)
+        self.hooks = signals.has_receivers(self.__class__)
+        budget = [options.get(name) for name in ('max_queries', 'max_objects', 'max_seconds')]
+        if budget != [None] * 3:
+            if workers > 1:
+                raise CommandError("--max-queries, --max-objects and --max-seconds "
+                                   "can't be used with --workers.")
+            self.budget = Budget(using, *budget)
+            self.on_budget = options.get("on_budget")
+            self.truncated = defaultdict(int)
+        manifest_file = options.get("manifest")
+        since = options.get("since")
+        if since is not None:
+            since = parse_since(since)
+            if not snapshot_file:
+                raise CommandError("--since needs the --snapshot of a previous dump.")
+            if limit or max_depth is not None:
+                raise CommandError("--since can't be used with --limit or --depth.")
+            if checkpoint_file or resume_file:
+                raise CommandError("--since can't be used with --checkpoint or --resume.")
 
-        SerializerClass = get_serializer(format)()  # NOQA
+        SerializerClass = get_serializer(format, fast)()  # NOQA
         self.use_gfks = hasattr(SerializerClass, 'handle_gfk_field')
         if model_diagram_file and object_diagram_file:
             raise CommandError("You can't generate a model diagram and an object diagram at the same time.")
@@ -345,62 +1197,257 @@ class Command(BaseCommand):
         main_model = args[0]
         app_label, model_name = main_model.split('.')
         primary_model = apps.get_model(app_label, model_name)
+        self.using = using
+        if resume_file or checkpoint_file:
+            arguments = [list(args), format, list(excludes), includes, limit,
+                         max_depth, using, output_file]
+            if resume_file:
+                self.checkpoint = Checkpoint(resume_file)
+                saved_arguments = self.checkpoint.get('arguments')
+                if saved_arguments not in (None, arguments):
+                    raise CommandError(
+                        "%s was saved by a dump with other arguments: %s" % (
+                            resume_file, saved_arguments))
+            else:
+                self.checkpoint = Checkpoint(checkpoint_file, reset=True)
+            with self.checkpoint.db:
+                self.checkpoint.set('arguments', arguments)
+        if cache_file:
+            self.cache = GraphCache(
+                cache_file, get_config(main_model, limit, sorted(excludes), sorted(includes or [])),
+                using, options.get("cache_size"))
         obj_filter = ObjectFilter(primary_model, excludes, includes)
 
         ids = [id_cast(i) for i in args[1:]]
 
         # Lookup initial model records.
         if ids:
-            objs = primary_model.objects.using(using).filter(pk__in=ids).iterator()
+            objs = primary_model.objects.using(using).filter(pk__in=ids)
         else:
-            objs = primary_model.objects.using(using).iterator()
+            objs = primary_model.objects.using(using).all()
 
-        self.process_queue(objs, obj_filter, limit, max_depth)
+        if options.get("estimate"):
+            fields, excluded = get_fields()
+            seen = Estimate(self, obj_filter, limit, max_depth).run(
+                primary_model, objs.values_list('pk', flat=True))
+            sizes = projected_sizes(
+                seen, get_serializer(format)(), using, indent=indent,
+                use_natural_keys=use_natural_keys, fields=fields, exclude_fields=excluded)
+            self.report_estimate(seen, sizes)
+            return
+
+        delta = None
+        with self.phase("traversal"):
+            if since is not None:
+                snapshot = Checkpoint(snapshot_file)
+                delta = traverse_delta(self, snapshot, since, objs, obj_filter)
+                snapshot.close()
+                if delta is None:
+                    raise CommandError("%s has no graph to compare with." % snapshot_file)
+            elif workers > 1 and (self.checkpoint is None or self.checkpoint.get('depth') is None):
+                traverse_parallel(self, main_model, objs.values_list('pk', flat=True),
+                                  workers, excludes, includes, limit, max_depth)
+                self.queue = []
+                self.save_checkpoint(0, force=True)
+            else:
+                self.process_queue(objs.iterator(), obj_filter, limit, max_depth)
+
+        if self.cache is not None:
+            self.cache.close()
 
         # Order serialization so that dependents come after dependencies.
-        depends_on = dict(self.depends_on)
-        from objectdump.topological_sort import toposort
-        serialization_order = toposort(depends_on)
+        cycles = []
+        graph = self.depends_on
+        if delta is not None:
+            # Only the changed and new objects, after those they depend on
+            # that are changed or new too
+            changed = delta[0]
+            graph = dict((node, deps & changed)
+                         for node, deps in self.depends_on.items() if node in changed)
+        serialization_order = toposort(
+            graph, key=lambda n: get_node_key(n, as_tuple=True), cycles=cycles)
+        if debug or self.verbose or self.measured:
+            start = time.time()
+            with self.phase("toposort"):
+                serialization_order = list(serialization_order)
+            if self.hooks:
+                signals.toposort_finished.send(
+                    sender=self.__class__, objects=len(serialization_order),
+                    cycles=len(cycles), seconds=time.time() - start)
         try:
             try:
                 self.stdout.ending = None
             except AttributeError:
                 pass
             if debug:
-                pprint.pprint("----------------------------------------------", stream=self.stderr)
-                pprint.pprint("Which models cause which others to be included", stream=self.stderr)
-                pprint.pprint("----------------------------------------------", stream=self.stderr)
-                pprint.pprint(dict(self.generates), stream=self.stderr)
-                pprint.pprint("----------------------------------------------", stream=self.stderr)
-                pprint.pprint("Dependencies", stream=self.stderr)
-                pprint.pprint("----------------------------------------------", stream=self.stderr)
-                for model, fields in sorted(self.relationships.items()):
-                    pprint.pprint(model, stream=self.stderr)
+                self.write_debug("----------------------------------------------")
+                self.write_debug("Which models cause which others to be included")
+                self.write_debug("----------------------------------------------")
+                self.write_debug(self.format_graph(self.generates))
+                self.write_debug("----------------------------------------------")
+                self.write_debug("Dependencies")
+                self.write_debug("----------------------------------------------")
+                for model, fields in sorted(self.format_graph(self.relationships).items()):
+                    self.write_debug(model)
                     for field, items in sorted(fields.items()):
-                        pprint.pprint("     %s" % field, stream=self.stderr)
+                        self.write_debug("     %s" % field)
                         for item in items:
-                            pprint.pprint("         %s" % item, stream=self.stderr)
-                pprint.pprint("----------------------------------------------", stream=self.stderr)
-                pprint.pprint("Serialization order", stream=self.stderr)
-                pprint.pprint("----------------------------------------------", stream=self.stderr)
-                pprint.pprint(list(serialization_order), stream=self.stderr)
+                            self.write_debug("         %s" % item)
+                self.write_debug("----------------------------------------------")
+                self.write_debug("Serialization order")
+                self.write_debug("----------------------------------------------")
+                self.write_debug([get_node_key(n) for n in serialization_order])
+                self.write_debug("----------------------------------------------")
+                self.write_debug("Relations not followed, their models are filtered out")
+                self.write_debug("----------------------------------------------")
+                self.write_debug(self.format_pruned())
+                self.report_cycles(cycles)
                 return
             if model_diagram_file:
-                make_dot(self.relationships, model_diagram_file)
+                make_dot(self.format_graph(self.relationships), model_diagram_file)
             elif object_diagram_file:
-                make_dot(self.relationships, object_diagram_file)
-            to_serialize = [o for o in list(serialization_order) if o is not None]
+                make_dot(self.format_graph(self.relationships), object_diagram_file)
             if self.verbose:
-                pprint.pprint(to_serialize, stream=self.stderr)
+                self.write_debug([get_node_key(n) for n in serialization_order])
+            if not snapshot_file:
+                # Only the dependencies are needed from here on
+                self.relationships = self.generates = self.priors = None
             fields, excluded = get_fields()
-            SerializerClass.serialize(
-                to_serialize,
-                indent=indent,
-                use_natural_keys=use_natural_keys,
-                stream=self.stdout,
-                fields=fields,
-                exclude_fields=excluded)
+            # Only JSON Lines written to an uncompressed file can be appended
+            # to when the dump is resumed
+            offset = None
+            self.resumable = bool(self.checkpoint is not None and output_file and
+                                  format == 'jsonl' and not is_compressed(output_file))
+            if self.resumable:
+                emitted = self.checkpoint.get_emitted()
+                if emitted:
+                    offset = self.checkpoint.get('offset')
+                    serialization_order = (
+                        n for n in serialization_order if n not in emitted)
+                self.written = []
+                self.checkpoint_time = time.time()
+            elif self.checkpoint is not None:
+                self.checkpoint.reset_emitted()
+            self.output = self.stdout
+            if output_file:
+                self.output = open_output(output_file, offset=offset)
+            with self.phase("serialization"):
+                try:
+                    if hasattr(SerializerClass, 'serialize_chunks'):
+                        SerializerClass.serialize_chunks(
+                            self.track_chunks(iter_node_chunks(serialization_order, chunk_size)),
+                            using=using,
+                            indent=indent,
+                            stream=self.output,
+                            fields=fields,
+                            exclude_fields=excluded)
+                    else:
+                        SerializerClass.serialize(
+                            self.stream_objects(serialization_order, chunk_size,
+                                                SerializerClass.batches_m2m(use_natural_keys)),
+                            indent=indent,
+                            use_natural_keys=use_natural_keys,
+                            stream=self.output,
+                            fields=fields,
+                            exclude_fields=excluded)
+                finally:
+                    if output_file:
+                        self.output.close()
+                    if self.checkpoint is not None:
+                        self.checkpoint.close()
+            self.report_cycles(cycles)
+            if self.budget is not None and self.budget.reason is not None:
+                self.report_truncated()
+            if self.stats is not None:
+                self.write_stats(stats_file)
+            if delta is not None and manifest_file:
+                with open(manifest_file, 'w') as f:
+                    json.dump({
+                        'since': since.isoformat(),
+                        'removed': sorted(get_node_key(n) for n in delta[1]),
+                    }, f, indent=2)
+            if snapshot_file:
+                snapshot = Checkpoint(snapshot_file, reset=True)
+                self.queue = []
+                snapshot.save_traversal(self, 0)
+                snapshot.close()
         except Exception as e:
             if show_traceback:
                 raise
             raise CommandError("Unable to serialize database: %s" % e)
+
+    def format_pruned(self):
+        """
+        Return the relations pruned from the plans as sorted
+        ``"app.model.relation -> app.model"`` strings
+        """
+        pruned = []
+        for plan in self.plans.values():
+            for name, related_model in plan.pruned:
+                pruned.append("%s.%s -> %s.%s" % (
+                    plan.key, name, related_model._meta.app_label,
+                    related_model._meta.model_name))
+        return sorted(pruned)
+
+    def stream_objects(self, nodes, chunk_size=None, prefetch_m2m=False):
+        """
+        Yield the objects of ``nodes`` a chunk at a time, flushing the output
+        once each chunk has been written so only one chunk is held in memory.
+        With ``prefetch_m2m``, the many-to-many values of each chunk are
+        fetched with one query per field.
+        """
+        if self.measured:
+            start = self.begin()
+        for chunk in hydrate_chunks(nodes, self.using, chunk_size):
+            if prefetch_m2m:
+                prefetch_m2m_values(chunk, self.using)
+            for obj in chunk:
+                yield obj
+            self.output.flush()
+            if self.measured and chunk:
+                self.flushed(chunk[0].__class__, start, len(chunk))
+                start = self.begin()
+            if self.resumable:
+                self.chunk_written([get_node(obj) for obj in chunk])
+
+    def phase(self, name):
+        """
+        Return a context manager measuring the phase ``name`` for ``--stats``
+        """
+        if self.stats is None:
+            return nothing()
+        return self.stats.phase(name)
+
+    def write_stats(self, stats_file=None):
+        if stats_file:
+            with open(stats_file, 'w') as f:
+                json.dump(self.stats.report(), f, indent=2)
+        else:
+            for line in self.stats.format():
+                self.stderr.write(line)
+
+    def report_estimate(self, seen, sizes):
+        lines = []
+        for model, pks in seen.items():
+            key = "%s.%s" % (model._meta.app_label, model._meta.model_name)
+            lines.append("%-40s %10d %14d" % (key, len(pks), sizes[model]))
+        self.stdout.write("%-40s %10s %14s" % ("model", "objects", "size (bytes)"))
+        for line in sorted(lines):
+            self.stdout.write(line)
+        self.stdout.write("%-40s %10d %14d" % (
+            "total", sum(len(pks) for pks in seen.values()), sum(sizes.values())))
+
+    def report_truncated(self):
+        self.stderr.write(
+            "The dump went over its budget (%s) and was cut. These relations "
+            "weren't followed:" % self.budget.reason)
+        for (model_key, relation), objects in sorted(self.truncated.items()):
+            self.stderr.write("  %s.%s of %d objects" % (model_key, relation, objects))
+
+    def report_cycles(self, cycles):
+        """
+        Warn about the ``cycles`` of nodes that were serialized together,
+        with a ``CyclicDependencyWarning`` holding their components
+        """
+        if cycles:
+            warnings.warn(CyclicDependencyWarning(cycles, key=get_node_key))
@@ -7,12 +7,22 @@ try:
 
     def get_app(app_label):
         return apps.get_app_config(app_label).models_module
+
+    def get_all_models():
+        return apps.get_models(include_auto_created=True)
 except ImportError:
-    from django.db.models import get_model, get_app
+    from django.db.models import get_model, get_app, get_models
+
+    def get_all_models():
+        return get_models(include_auto_created=True)
+
+from itertools import groupby
 
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
 
-from .settings import MODEL_SETTINGS
+from .settings import MODEL_SETTINGS, BATCH_SIZE
 
 
 def get_key(obj, as_tuple=False, include_pk=True):
@@ -25,6 +35,171 @@ def get_key(obj, as_tuple=False, include_pk=True):
     return '.'.join(map(str, key))
 
 
+_content_type_ids = {}
+
+
+def get_content_type_id(model):
+    """
+    Return the id of the content type of ``model``'s concrete model.
+
+    Nodes always identify their model with its content type in the default
+    database, whatever database is dumped. The content type ids read from
+    the rows of the dumped database must be looked up with
+    ``ContentType.objects.db_manager(using)`` and translated.
+    """
+    try:
+        return _content_type_ids[model]
+    except KeyError:
+        ct_id = ContentType.objects.db_manager(DEFAULT_DB_ALIAS).get_for_model(
+            model, for_concrete_model=True).pk
+        _content_type_ids[model] = ct_id
+        return ct_id
+
+
+def warm_content_types(ids, using=DEFAULT_DB_ALIAS):
+    """
+    Load the content types of ``ids`` in the ``using`` database that aren't
+    cached yet with one query, so ``get_for_id`` of
+    ``ContentType.objects.db_manager(using)`` doesn't query them one at a
+    time
+    """
+    manager = ContentType.objects.db_manager(using)
+    cache = manager._cache.get(using, {})
+    missing = [ct_id for ct_id in set(ids) if ct_id not in cache]
+    if missing:
+        for ct in manager.filter(pk__in=missing):
+            manager._add_to_cache(using, ct)
+
+
+def get_node(obj):
+    """
+    Return the compact ``(content_type_id, pk)`` key of ``obj`` used in the
+    object graph. Proxy instances get the key of their concrete model.
+    """
+    return (get_content_type_id(obj.__class__), obj.pk)
+
+
+def get_concrete(obj):
+    """
+    Return ``obj`` as an instance of its concrete model, without querying
+    the database, since a proxy shares the table and the field values of its
+    concrete model. Returns ``None`` when some field values weren't loaded,
+    as with deferred instances.
+    """
+    model = obj._meta.concrete_model
+    if obj.__class__ is model:
+        return obj
+    for field in model._meta.concrete_fields:
+        if field.attname not in obj.__dict__:
+            return None
+    concrete = model.__new__(model)
+    concrete.__dict__.update(obj.__dict__)
+    return concrete
+
+
+def get_node_model(node):
+    """
+    Return the model class of a ``(content_type_id, pk)`` node
+    """
+    return ContentType.objects.db_manager(DEFAULT_DB_ALIAS).get_for_id(node[0]).model_class()
+
+
+def get_node_key(node, as_tuple=False, include_pk=True):
+    """
+    Same as ``get_key``, for a ``(content_type_id, pk)`` node
+    """
+    opts = get_node_model(node)._meta
+    key = [opts.app_label, opts.model_name, ]
+    if include_pk:
+        key.append(node[1])
+
+    if as_tuple:
+        return tuple(key)
+    return '.'.join(map(str, key))
+
+
+def iter_node_chunks(nodes, chunk_size=None):
+    """
+    Split ``nodes`` into ``(model, [pks])`` chunks of at most ``chunk_size``
+    consecutive nodes of the same model. ``nodes`` is consumed lazily.
+    """
+    for ct_id, run in groupby(nodes, key=lambda node: node[0]):
+        model = get_node_model((ct_id, None))
+        for pks in chunked((pk for _, pk in run), chunk_size):
+            yield model, pks
+
+
+def hydrate_chunks(nodes, using=DEFAULT_DB_ALIAS, chunk_size=None):
+    """
+    Yield the objects of ``nodes`` in the same order, as lists of at most
+    ``chunk_size`` objects of the same model. ``nodes`` is consumed lazily
+    and each chunk is fetched with one ``in_bulk``. Objects deleted since
+    they were traversed are skipped.
+    """
+    for model, pks in iter_node_chunks(nodes, chunk_size):
+        objs = model._base_manager.using(using).in_bulk(pks)
+        yield [objs[pk] for pk in pks if pk in objs]
+
+
+def hydrate(nodes, using=DEFAULT_DB_ALIAS, chunk_size=None):
+    """
+    Yield the objects of ``nodes`` in the same order. See ``hydrate_chunks``.
+    """
+    for chunk in hydrate_chunks(nodes, using, chunk_size):
+        for obj in chunk:
+            yield obj
+
+
+def group_by_model(objs):
+    """
+    Group ``objs`` by class, returning a list of ``(model, [objs])`` pairs in
+    the order each model was first seen
+    """
+    groups = []
+    by_model = {}
+    for obj in objs:
+        model = obj.__class__
+        if model not in by_model:
+            by_model[model] = []
+            groups.append((model, by_model[model]))
+        by_model[model].append(obj)
+    return groups
+
+
+def chunked(items, size=None):
+    """
+    Split ``items`` into lists of at most ``size`` items. Keeps ``__in``
+    lookups below the parameter limits of the database backends.
+    """
+    size = size or BATCH_SIZE
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_ordering(model, prefix=None):
+    """
+    Return the ``order_by()`` arguments that reproduce the default ordering
+    of ``model``, with the primary key as the final tie-breaker.
+
+    If ``prefix`` is given, the ordering is expressed through the relation of
+    that name, e.g. to order a many-to-many through table by its target.
+    """
+    ordering = [o for o in model._meta.ordering if o != '?'] + ['pk']
+    if prefix is None:
+        return ordering
+    output = []
+    for item in ordering:
+        desc = item.startswith('-')
+        output.append("%s%s__%s" % ('-' if desc else '', prefix, item.lstrip('-')))
+    return output
+
+
 def get_reverse_relations(obj):
     """
     Return all the related fields for an object
@@ -69,7 +244,12 @@ def get_apps_and_models(appmodel_list):
 
 class ObjectFilter(object):
     """
-    Handles all the stuff for excluding/including models and apps
+    Handles all the stuff for excluding/including models and apps.
+
+    The decision for every installed model is made once, when the filter is
+    created, so ``skip`` is a dict lookup. ``skip_model`` tells whether all
+    the objects of a model are filtered out, so relations to it don't need
+    to be fetched at all.
     """
     def __init__(self, primary_model, exclude_list=None, include_list=None):
         if isinstance(primary_model, basestring):
@@ -92,21 +272,41 @@ class ObjectFilter(object):
         self.included_apps, self.included_models = get_apps_and_models(
             include_list)
 
-    def skip(self, obj):
+        self.skipped_models = dict(
+            (model, self.decide(model)) for model in get_all_models())
+
+    def decide(self, model):
+        """
+        Return ``True`` if the objects of ``model`` are filtered out
+        """
+        if getattr(model, '_deferred', False):
+            model = model._meta.proxy_for_model
+
         # Skip ignored models.
-        if obj.__class__ in self.excluded_models:
+        if model in self.excluded_models:
             return True
 
-        if get_app(obj._meta.app_label) in self.excluded_apps:
+        app = get_app(model._meta.app_label)
+        if app in self.excluded_apps:
             return True
 
         # Skip models not specifically being included.
         if ((self.included_apps or self.included_models) and
-            not isinstance(obj, self.primary_model)):
-            if obj.__class__ not in self.included_models:
+                not issubclass(model, self.primary_model)):
+            if model not in self.included_models:
                 return True
 
-            if get_app(obj._meta.app_label) not in self.included_apps:
+            if app not in self.included_apps:
                 return True
 
         return False
+
+    def skip_model(self, model):
+        try:
+            return self.skipped_models[model]
+        except KeyError:
+            # Classes created at runtime, like deferred models
+            return self.decide(model)
+
+    def skip(self, obj):
+        return self.skip_model(obj.__class__)
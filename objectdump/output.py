@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Output files for object_dump, compressed according to their extension.
+"""
+import bz2
+import gzip
+import io
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import six
+
+
+def open_zstd(path):
+    if zstandard is None:
+        raise ImproperlyConfigured("Writing .zst files requires the zstandard package.")
+    return zstandard.ZstdCompressor().stream_writer(io.open(path, 'wb'))
+
+
+def open_xz(path):
+    if lzma is None:
+        raise ImproperlyConfigured("Writing .xz files requires the lzma module "
+                                   "(backports.lzma on Python 2).")
+    return lzma.LZMAFile(path, 'wb')
+
+
+COMPRESSORS = {
+    '.gz': lambda path: gzip.GzipFile(path, 'wb'),
+    '.bz2': lambda path: bz2.BZ2File(path, 'wb'),
+    '.xz': open_xz,
+    '.zst': open_zstd,
+}
+
+
+def open_file(path):
+    """
+    Open ``path`` for writing bytes, through the compressor matching its
+    extension, if any
+    """
+    for extension, opener in COMPRESSORS.items():
+        if path.endswith(extension):
+            return opener(path)
+    return io.open(path, 'wb')
+
+
+class ThreadedWriter(object):
+    """
+    A text stream that writes UTF-8 to a file object on a background thread.
+
+    Writes are buffered and handed to the thread ``buffer_size`` bytes at a
+    time, so compressing and writing the output overlaps with fetching and
+    serializing objects. At most ``max_pending`` buffers wait for the thread,
+    which bounds the memory used when the thread can't keep up.
+    """
+    def __init__(self, fileobj, buffer_size=1 << 20, max_pending=8):
+        self.fileobj = fileobj
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.error = None
+        self.queue = Queue(max_pending)
+        self.thread = threading.Thread(target=self._run, name='objectdump-output')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            data = self.queue.get()
+            try:
+                if data is None:
+                    break
+                if self.error is None:
+                    self.fileobj.write(data)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, text):
+        if isinstance(text, six.text_type):
+            text = text.encode('utf-8')
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Hand the buffered output to the writing thread
+        """
+        self._check()
+        if self.buffer:
+            self.queue.put(b''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def sync(self):
+        """
+        Wait until everything written so far is in the file and return the
+        position in the file
+        """
+        self.flush()
+        self.queue.join()
+        self._check()
+        self.fileobj.flush()
+        return self.fileobj.tell()
+
+    def close(self):
+        """
+        Write everything that is left, wait for the thread and close the file
+        """
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+            self.fileobj.close()
+        self._check()
+
+
+def is_compressed(path):
+    return any(path.endswith(extension) for extension in COMPRESSORS)
+
+
+def open_output(path, offset=None, **kwargs):
+    """
+    Open ``path`` as a ``ThreadedWriter``, compressed according to its
+    extension: ``.gz``, ``.bz2``, ``.xz`` or ``.zst``
+
+    With an ``offset``, an uncompressed file is truncated to ``offset``
+    bytes and written after them instead.
+    """
+    if offset:
+        if is_compressed(path):
+            raise ValueError("Can't append to the compressed file %s" % path)
+        fileobj = io.open(path, 'r+b')
+        fileobj.truncate(offset)
+        fileobj.seek(offset)
+        return ThreadedWriter(fileobj, **kwargs)
+    return ThreadedWriter(open_file(path), **kwargs)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Per-model plans of the relations object_dump follows.
+"""
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.db.models import ForeignKey
+
+from .settings import MODEL_SETTINGS
+
+
+def select(setting, names):
+    """
+    Apply a ``MODEL_SETTINGS`` value to the list of available ``names``. It
+    could be ``True`` for all, ``False`` for none, or an iterable of names.
+    """
+    if setting is True:
+        return list(names)
+    elif setting is False:
+        return []
+    return list(setting)
+
+
+class RelationPlan(object):
+    """
+    The relations to follow from the objects of one model, after applying
+    its ``MODEL_SETTINGS``. Built once per model and then executed for every
+    batch of its objects.
+
+    ``reverse_relations`` and ``many_to_many`` are lists of
+    ``(name, field)``. ``field`` is ``None`` for names that aren't a reverse
+    foreign key or a many-to-many field of the model; those are looked up
+    object by object.
+
+    With an ``obj_filter``, relations to a model it filters out are left out
+    of the plan, so they are never queried, and listed in ``pruned`` as
+    ``(name, related model)``.
+    """
+    def __init__(self, model, obj_filter=None):
+        opts = model._meta
+        self.model = model
+        self.key = ".".join([opts.app_label, opts.model_name])
+        settings = MODEL_SETTINGS.get(self.key, {})
+
+        related_objects = dict(
+            (rel.get_accessor_name(), rel) for rel in opts.get_all_related_objects())
+        names = list(related_objects.keys())
+        self.reverse_relations = []
+        for name in select(settings.get('reverse_relations', names), names):
+            related = related_objects.get(name)
+            if related is None or not isinstance(related.field, ForeignKey):
+                self.reverse_relations.append((name, None))
+            else:
+                self.reverse_relations.append((name, related.field))
+
+        m2m_by_name = dict((f.name, f) for f in opts.many_to_many)
+        names = [f.name for f in opts.many_to_many]
+        self.many_to_many = [
+            (name, m2m_by_name.get(name))
+            for name in select(settings.get('m2m_fields', names), names)]
+
+        names = opts.get_all_field_names()
+        fk_names = select(settings.get('fk_fields', names), names)
+        self.foreign_keys = [
+            f for f in opts.fields if isinstance(f, ForeignKey) and f.name in fk_names]
+
+        names = [f.name for f in opts.virtual_fields]
+        gfk_names = select(settings.get('gfk_fields', names), names)
+        self.generic_foreign_keys = [
+            f for f in opts.virtual_fields
+            if isinstance(f, GenericForeignKey) and f.name in gfk_names]
+        self.generic_relations = [
+            f for f in opts.virtual_fields
+            if isinstance(f, GenericRelation) and f.name in gfk_names]
+
+        self.additional_relations = settings.get('addl_relations', [])
+
+        self.pruned = []
+        if obj_filter is not None:
+            self.prune(obj_filter)
+
+    def prune(self, obj_filter):
+        def keep(name, field, related_model):
+            if field is None or not obj_filter.skip_model(related_model):
+                return True
+            self.pruned.append((name, related_model))
+            return False
+        self.reverse_relations = [
+            (name, field) for name, field in self.reverse_relations
+            if keep(name, field, field and field.model)]
+        self.many_to_many = [
+            (name, field) for name, field in self.many_to_many
+            if keep(name, field, field and field.rel.to)]
+        self.foreign_keys = [
+            field for field in self.foreign_keys
+            if keep(field.name, field, field.rel.to._meta.concrete_model)]
+        self.generic_relations = [
+            field for field in self.generic_relations
+            if keep(field.name, field, field.rel.to)]
+
+    def depth_limited(self):
+        """
+        Return the names of the relations only followed up to ``--depth``
+        """
+        return set([name for name, field in self.reverse_relations] +
+                   [name for name, field in self.many_to_many] +
+                   [field.name for field in self.generic_relations])
+
+    def __repr__(self):
+        return "<RelationPlan: %s>" % self.key
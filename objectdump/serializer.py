@@ -1,6 +1,44 @@
 from django.utils import six
 from collections import defaultdict
 from django.contrib.contenttypes.fields import GenericRelation
+from django.core.serializers.python import Serializer as PythonSerializer
+from django.db import models, DEFAULT_DB_ALIAS
+from django.utils.encoding import smart_text, is_protected_type
+
+
+def get_m2m_values(field, pks, using=DEFAULT_DB_ALIAS):
+    """
+    Return ``{pk: [related pks]}`` for the many-to-many ``field`` of the
+    objects in ``pks``, in the order ``obj.<field>.iterator()`` returns them
+    """
+    from objectdump.models import get_ordering
+    through = field.rel.through
+    target_name = field.m2m_reverse_field_name()
+    source_attname = through._meta.get_field(field.m2m_field_name()).attname
+    target_attname = through._meta.get_field(target_name).attname
+    rows = through._default_manager.using(using).filter(
+        **{"%s__in" % source_attname: pks}).order_by(
+        *get_ordering(field.rel.to, target_name)).values_list(source_attname, target_attname)
+    values = defaultdict(list)
+    for source_pk, target_pk in rows:
+        values[source_pk].append(smart_text(target_pk, strings_only=True))
+    return values
+
+
+def prefetch_m2m_values(objs, using=DEFAULT_DB_ALIAS):
+    """
+    Fetch the many-to-many values of ``objs``, all of the same model, with
+    one query per field, for ``PerObjectSerializer.handle_m2m_field``
+    """
+    if not objs:
+        return
+    concrete_model = objs[0]._meta.concrete_model
+    pks = [obj.pk for obj in objs]
+    fields = [field for field in concrete_model._meta.many_to_many
+              if field.serialize and field.rel.through._meta.auto_created]
+    m2m_values = [(field.name, get_m2m_values(field, pks, using)) for field in fields]
+    for obj in objs:
+        obj._m2m_values = dict((name, values.get(obj.pk, [])) for name, values in m2m_values)
 
 
 class PerObjectSerializer(object):
@@ -57,14 +95,9 @@ class PerObjectSerializer(object):
         self.cached_selected_fields[key] = list(selected_fields)
         return self.cached_selected_fields[key]
 
-    def serialize(self, queryset, **options):
+    def prepare(self, options):
         """
-        Serialize a queryset.
-
-        ``fields`` now accepts a dict of {'app_label.model': ['field1', ...]}
-        ``exclude_fields`` accepts a dict in the above format. These fields
-        are removed from all fields
-
+        Set up the serializer from the ``serialize`` options
         """
         self.options = options
         self.stream = options.pop("stream", six.StringIO())
@@ -73,46 +106,248 @@ class PerObjectSerializer(object):
         self.use_natural_primary_keys = options.pop('use_natural_primary_keys', False)
         self.use_gfks = hasattr(self, 'handle_gfk_field') and self.use_natural_keys
 
-        included_fields = options.pop("fields", {})
-        excluded_fields = options.pop("exclude_fields", {})
+        self.batch_m2m = self.batches_m2m(self.use_natural_keys or self.use_natural_foreign_keys)
+        self.included_fields = options.pop("fields", {})
+        self.excluded_fields = options.pop("exclude_fields", {})
         self.cached_selected_fields = defaultdict(set)
 
+    def serialize_object(self, obj):
+        self.selected_fields = self.get_selected_fields(obj, self.included_fields, self.excluded_fields)
+        try:
+            obj._get_pk_val()
+        except:
+            return
+        self.start_object(obj)
+        # Use the concrete parent class' _meta instead of the object's _meta
+        # This is to avoid local_fields problems for proxy models. Refs #17717.
+        concrete_model = obj._meta.concrete_model
+        for field in concrete_model._meta.local_fields:
+            if field.serialize:
+                if field.rel is None:
+                    if self.selected_fields is None or field.attname in self.selected_fields:
+                        self.handle_field(obj, field)
+                else:
+                    if self.selected_fields is None or field.attname[:-3] in self.selected_fields:
+                        self.handle_fk_field(obj, field)
+        for field in concrete_model._meta.many_to_many:
+            if field.serialize:
+                if self.selected_fields is None or field.attname in self.selected_fields:
+                    self.handle_m2m_field(obj, field)
+        if self.use_gfks:
+            for field in concrete_model._meta.virtual_fields:
+                if self.selected_fields is None or field.name in self.selected_fields:
+                        self.handle_gfk_field(obj, field)
+        self.end_object(obj)
+        if self.first:
+            self.first = False
+
+    def batches_m2m(self, use_natural_keys=False):
+        """
+        Whether ``handle_m2m_field`` can use the values of
+        ``prefetch_m2m_values``
+        """
+        return isinstance(self, PythonSerializer) and not use_natural_keys
+
+    def handle_m2m_field(self, obj, field):
+        """
+        Use the values of ``prefetch_m2m_values``, if they were fetched,
+        instead of querying the values of each object
+        """
+        m2m_values = getattr(obj, '_m2m_values', None)
+        if self.batch_m2m and m2m_values is not None and field.name in m2m_values:
+            self._current[field.name] = m2m_values[field.name]
+        else:
+            super(PerObjectSerializer, self).handle_m2m_field(obj, field)
+
+    def serialize(self, queryset, **options):
+        """
+        Serialize a queryset.
+
+        ``fields`` now accepts a dict of {'app_label.model': ['field1', ...]}
+        ``exclude_fields`` accepts a dict in the above format. These fields
+        are removed from all fields
+
+        """
+        self.prepare(options)
         self.start_serialization()
         self.first = True
         for obj in queryset:
-            self.selected_fields = self.get_selected_fields(obj, included_fields, excluded_fields)
-            try:
-                obj._get_pk_val()
-            except:
+            self.serialize_object(obj)
+        self.end_serialization()
+        return self.getvalue()
+
+
+class RowObject(object):
+    """
+    Stands in for a model instance when a serializer's ``end_object`` builds
+    the output of a row fetched with ``values_list``
+    """
+    __slots__ = ('_meta', 'pk')
+
+    def __init__(self, model, pk):
+        self._meta = model._meta
+        self.pk = pk
+
+    def _get_pk_val(self):
+        return self.pk
+
+
+def _func(method):
+    return getattr(method, '__func__', method)
+
+
+class FieldPlan(object):
+    """
+    What ``FastPerObjectSerializer`` needs to serialize the rows of a model:
+    the ``attnames`` to fetch, the output name of each of those columns and
+    whether it needs converting to text, and the many-to-many fields.
+    """
+    def __init__(self, model, selected_fields):
+        self.model = model
+        self.attnames = [model._meta.pk.attname]
+        self.columns = []  # [(output name, convert to text)]
+        self.m2m_fields = []
+        concrete_model = model._meta.concrete_model
+        for field in concrete_model._meta.local_fields:
+            if not field.serialize:
                 continue
-            self.start_object(obj)
-            # Use the concrete parent class' _meta instead of the object's _meta
-            # This is to avoid local_fields problems for proxy models. Refs #17717.
-            concrete_model = obj._meta.concrete_model
-            for field in concrete_model._meta.local_fields:
-                if field.serialize:
-                    if field.rel is None:
-                        if self.selected_fields is None or field.attname in self.selected_fields:
-                            self.handle_field(obj, field)
-                    else:
-                        if self.selected_fields is None or field.attname[:-3] in self.selected_fields:
-                            self.handle_fk_field(obj, field)
-            for field in concrete_model._meta.many_to_many:
-                if field.serialize:
-                    if self.selected_fields is None or field.attname in self.selected_fields:
-                        self.handle_m2m_field(obj, field)
-            if self.use_gfks:
-                for field in concrete_model._meta.virtual_fields:
-                    if self.selected_fields is None or field.name in self.selected_fields:
-                            self.handle_gfk_field(obj, field)
-            self.end_object(obj)
+            if field.rel is None:
+                if selected_fields is not None and field.attname not in selected_fields:
+                    continue
+                self.attnames.append(field.attname)
+                self.columns.append((field.name, True))
+            else:
+                if selected_fields is not None and field.attname[:-3] not in selected_fields:
+                    continue
+                self.attnames.append(field.attname)
+                self.columns.append((field.name, False))
+        for field in concrete_model._meta.many_to_many:
+            if field.serialize and field.rel.through._meta.auto_created:
+                if selected_fields is None or field.attname in selected_fields:
+                    self.m2m_fields.append(field)
+
+    @classmethod
+    def can_plan(cls, model):
+        """
+        Rows of ``model`` can be serialized from ``values_list`` if none of
+        its fields needs an instance to be converted to text
+        """
+        try:
+            from django.db.models.fields.subclassing import SubfieldBase
+        except ImportError:
+            SubfieldBase = None
+        for field in model._meta.concrete_model._meta.local_fields:
+            if SubfieldBase is not None and isinstance(type(field), SubfieldBase):
+                return False
+            if _func(type(field)._get_val_from_obj) is not _func(models.Field._get_val_from_obj):
+                return False
+            if (field.rel is None and
+                    not isinstance(field, (models.DateField, models.TimeField)) and
+                    _func(type(field).value_to_string) is not _func(models.Field.value_to_string)):
+                return False
+        return True
+
+
+class FastPerObjectSerializer(PerObjectSerializer):
+    """
+    Serializes chunks of ``(model, [pks])`` straight from ``values_list``
+    rows instead of model instances, skipping the ``handle_*`` calls for each
+    field of each object. The many-to-many values of a chunk are fetched with
+    one query on the through table per field.
+
+    Only works with serializers based on the python serializer, like
+    ``json``, and without natural keys. The output is the same as
+    ``serialize``.
+    """
+    def get_field_plan(self, model):
+        if model not in self.field_plans:
+            if FieldPlan.can_plan(model):
+                selected_fields = self.get_selected_fields(
+                    model, self.included_fields, self.excluded_fields)
+                self.field_plans[model] = FieldPlan(model, selected_fields)
+            else:
+                self.field_plans[model] = None
+        return self.field_plans[model]
+
+    def serialize_rows(self, plan, pks, using):
+        rows = plan.model._base_manager.using(using).filter(
+            pk__in=pks).values_list(*plan.attnames)
+        rows = dict((row[0], row) for row in rows)
+        m2m_values = [(field.name, get_m2m_values(field, pks, using))
+                      for field in plan.m2m_fields]
+        for pk in pks:
+            row = rows.get(pk)
+            if row is None:
+                continue
+            row_obj = RowObject(plan.model, pk)
+            self.start_object(row_obj)
+            for (name, convert), value in zip(plan.columns, row[1:]):
+                if convert and not is_protected_type(value):
+                    value = smart_text(value)
+                self._current[name] = value
+            for name, values in m2m_values:
+                self._current[name] = values.get(pk, [])
+            self.end_object(row_obj)
             if self.first:
                 self.first = False
+
+    def serialize_chunks(self, chunks, using=DEFAULT_DB_ALIAS, **options):
+        """
+        Serialize ``(model, [pks])`` chunks, flushing the stream after each.
+        """
+        self.prepare(options)
+        self.field_plans = {}
+        self.start_serialization()
+        self.first = True
+        for model, pks in chunks:
+            plan = self.get_field_plan(model)
+            if plan is None:
+                objs = model._base_manager.using(using).in_bulk(pks)
+                for pk in pks:
+                    if pk in objs:
+                        self.serialize_object(objs[pk])
+            else:
+                self.serialize_rows(plan, pks, using)
+            if hasattr(self.stream, 'flush'):
+                self.stream.flush()
         self.end_serialization()
         return self.getvalue()
 
 
-def get_serializer(format='json'):
-    from django.core.serializers import get_serializer as dj_get_ser
-    s = dj_get_ser(format)
+def get_format_serializer(format='json'):
+    """
+    Return Django's serializer class for ``format``, or the JSON Lines one
+    """
+    from django.core.serializers import get_serializer as dj_get_ser, SerializerDoesNotExist
+    try:
+        return dj_get_ser(format)
+    except SerializerDoesNotExist:
+        if format != 'jsonl':
+            raise
+        from objectdump.jsonl import Serializer
+        return Serializer
+
+
+def has_fast_path(format='json'):
+    """
+    Return whether ``format`` can be written by ``FastPerObjectSerializer``:
+    its serializer must be based on the python serializer and leave its
+    field handlers alone, which the fast path doesn't call. The yaml
+    serializer, for one, changes ``handle_field``.
+    """
+    s = get_format_serializer(format)
+    if not (isinstance(s, type) and issubclass(s, PythonSerializer)):
+        return False
+    return all(getattr(s, name).__func__ is getattr(PythonSerializer, name).__func__
+               for name in ('handle_field', 'handle_fk_field', 'handle_m2m_field'))
+
+
+def get_serializer(format='json', fast=False):
+    """
+    Return the serializer class for ``format``. With ``fast``, serializers
+    that ``has_fast_path`` also get ``serialize_chunks``.
+    """
+    s = get_format_serializer(format)
+    if fast and has_fast_path(format):
+        return type('CustomSerializer', (FastPerObjectSerializer, s), {})
     return type('CustomSerializer', (PerObjectSerializer, s), {})
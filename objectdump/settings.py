@@ -3,7 +3,8 @@ from django.conf import settings as site_settings
 
 
 DEFAULT_SETTINGS = {
-    'MODEL_SETTINGS': {}
+    'MODEL_SETTINGS': {},
+    'BATCH_SIZE': 500,
 }
 
 USER_SETTINGS = DEFAULT_SETTINGS.copy()
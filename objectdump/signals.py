@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Signals sent by object_dump around the steps of a dump, with the
+``Command`` class as sender, to feed their counts and timings to a
+monitoring system. Times are in seconds.
+
+The command only sends them when they have receivers when it starts. With
+``--concurrency``, ``relation_fetched`` may be sent from other threads, and
+with ``--workers`` the signals of the traversal are sent in the worker
+processes, to the receivers they inherited.
+"""
+from django.dispatch import Signal
+
+# Before a level of the traversal; ``objects`` is the size of its queue
+level_started = Signal(providing_args=["depth", "objects"])
+
+# After a level; ``objects`` were traversed and ``next_level`` queued
+level_finished = Signal(providing_args=["depth", "objects", "next_level", "seconds"])
+
+# After the batch fetch of a relation for the objects of a model in a level;
+# ``objects`` is the number of rows fetched
+relation_fetched = Signal(providing_args=["model", "relation", "objects", "seconds"])
+
+# Once the objects are sorted; ``cycles`` is the number of cycles broken
+toposort_finished = Signal(providing_args=["objects", "cycles", "seconds"])
+
+# Once a chunk of ``objects`` of ``model`` is written to the output
+chunk_flushed = Signal(providing_args=["model", "objects", "seconds"])
+
+SIGNALS = (level_started, level_finished, relation_fetched, toposort_finished, chunk_flushed)
+
+
+def has_receivers(sender):
+    return any(signal.has_listeners(sender) for signal in SIGNALS)
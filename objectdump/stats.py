@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+The statistics of a dump, collected for ``--stats``.
+
+Queries are counted by wrapping the cursors of the database connection, so
+they are counted even when ``DEBUG`` is off, and none are missed when there
+are more than the query log of the connection keeps. Queries are attributed
+to the model and relation of the step that ran them; those run outside of
+any step are reported as ``other``.
+"""
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from django.db import connections
+
+
+def get_model_key(model):
+    return ".".join([model._meta.app_label, model._meta.model_name])
+
+
+class QueryCounter(object):
+    """
+    Count the queries run by the cursors of ``connection`` and the seconds
+    they take
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.queries = 0
+        self.seconds = 0.0
+        make_cursor = connection.make_cursor
+        make_debug_cursor = connection.make_debug_cursor
+        connection.make_cursor = lambda cursor: CountingCursor(make_cursor(cursor), self)
+        connection.make_debug_cursor = lambda cursor: CountingCursor(make_debug_cursor(cursor), self)
+
+    def add(self, start):
+        self.queries += 1
+        self.seconds += time.time() - start
+
+    def take(self):
+        """
+        Return the queries, and their seconds, counted since the last call
+        """
+        counted = self.queries, self.seconds
+        self.queries, self.seconds = 0, 0.0
+        return counted
+
+    def remove(self):
+        del self.connection.make_cursor
+        del self.connection.make_debug_cursor
+        del self.connection.query_counter
+
+
+class CountingCursor(object):
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return self.cursor.__exit__(type, value, traceback)
+
+    def execute(self, sql, params=None):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.counter.add(start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.counter.add(start)
+
+
+def take_queries(connection):
+    """
+    Start counting the queries of ``connection`` and return the number of
+    queries run since the last call, and their seconds
+    """
+    counter = getattr(connection, 'query_counter', None)
+    if counter is None:
+        counter = connection.query_counter = QueryCounter(connection)
+    return counter.take()
+
+
+@contextmanager
+def stop_counting_queries(connection):
+    """
+    Stop counting the queries of ``connection`` after the ``with`` block if
+    ``take_queries`` started counting them in it
+    """
+    counting = hasattr(connection, 'query_counter')
+    try:
+        yield
+    finally:
+        if not counting and hasattr(connection, 'query_counter'):
+            connection.query_counter.remove()
+
+
+def peak_rss():
+    """
+    Return the peak resident memory of the process in MB, or ``None`` if
+    it isn't available
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
+
+
+class Stats(object):
+    def __init__(self, using):
+        self.using = using
+        self.lock = threading.Lock()
+        self.phases = {}  # {phase: seconds}
+        self.steps = defaultdict(lambda: {
+            'queries': 0, 'query_seconds': 0.0, 'seconds': 0.0, 'objects': 0})
+        self.peak_queue = 0
+        self.queries = 0
+
+    def add(self, model_key, relation, queries=(0, 0.0), seconds=0.0, objects=0):
+        queries, query_seconds = queries
+        with self.lock:
+            self.queries += queries
+            step = self.steps[(model_key, relation)]
+            step['queries'] += queries
+            step['query_seconds'] += query_seconds
+            step['seconds'] += seconds
+            step['objects'] += objects
+
+    def begin(self):
+        """
+        Start measuring a step. Queries run since the last step count as
+        ``other``.
+        """
+        self.add(None, 'other', take_queries(connections[self.using]))
+        return time.time()
+
+    def end(self, model, relation, start, objects=0):
+        """
+        Attribute the queries run since ``begin`` returned ``start``, and
+        the time spent, to ``relation`` of ``model``
+        """
+        self.add(get_model_key(model), relation, take_queries(connections[self.using]),
+                 time.time() - start, objects)
+
+    @contextmanager
+    def phase(self, name):
+        start = self.begin()
+        yield
+        self.add(None, 'other', take_queries(connections[self.using]))
+        self.phases[name] = self.phases.get(name, 0.0) + time.time() - start
+
+    def add_objects(self, model, relation, objects):
+        self.add(get_model_key(model), relation, objects=objects)
+
+    def queue_size(self, size):
+        self.peak_queue = max(self.peak_queue, size)
+
+    def report(self):
+        """
+        Return the statistics as a dict that can be written as JSON
+        """
+        steps = []
+        models = defaultdict(lambda: {'queries': 0, 'query_seconds': 0.0, 'objects': 0})
+        for (model_key, relation), step in sorted(self.steps.items(), key=lambda item: (
+                -item[1]['query_seconds'], -item[1]['queries'], item[0][0] or '', item[0][1])):
+            steps.append(dict(step, model=model_key, relation=relation))
+            if model_key is not None:
+                for name in ('queries', 'query_seconds', 'objects'):
+                    models[model_key][name] += step[name]
+        return {
+            'phases': self.phases,
+            'queries': sum(step['queries'] for step in self.steps.values()),
+            'query_seconds': sum(step['query_seconds'] for step in self.steps.values()),
+            'relations': steps,
+            'models': dict(models),
+            'peak_queue': self.peak_queue,
+            'peak_rss_mb': peak_rss(),
+        }
+
+    def format(self):
+        """
+        Return the statistics as lines of text
+        """
+        report = self.report()
+        lines = ["Time:"]
+        for phase in ('traversal', 'toposort', 'serialization'):
+            if phase in report['phases']:
+                lines.append("  %-15s %10.3fs" % (phase, report['phases'][phase]))
+        lines.append("Queries: %d in %.3fs" % (report['queries'], report['query_seconds']))
+        lines.append("Peak queue size: %d" % report['peak_queue'])
+        if report['peak_rss_mb'] is not None:
+            lines.append("Peak memory: %.1f MB" % report['peak_rss_mb'])
+        lines.append("%-40s %8s %10s %10s %10s" % (
+            "model.relation", "queries", "query (s)", "time (s)", "objects"))
+        for step in report['relations']:
+            name = "%s.%s" % (step['model'], step['relation']) if step['model'] else step['relation']
+            lines.append("%-40s %8d %10.3f %10.3f %10d" % (
+                name, step['queries'], step['query_seconds'], step['seconds'], step['objects']))
+        return lines
@@ -1,87 +1,176 @@
 """
-Special thanks to Stephen McDonald and his blog post at
-http://blog.jupo.org/2012/04/06/topological-sorting-acyclic-directed-graphs/
+Topological sorting of the object dependency graph.
+
+``toposort`` is Kahn's algorithm: every item keeps a counter of the
+dependencies that haven't been yielded yet and items are yielded as their
+counter drops to zero. It runs in O(V + E), plus sorting each layer of items
+that become ready at the same time, which keeps the output deterministic.
+
+Items left over once no counter can drop to zero are part of, or depend on,
+a cycle. Those are grouped into strongly connected components, which are
+sorted the same way.
 """
+from collections import defaultdict
+
+
+class CyclicDependencyError(RuntimeError):
+    """
+    Raised when the items can't be sorted because some of them depend on
+    each other. ``components`` is the list of groups of items forming cycles.
+    """
+    def __init__(self, components):
+        self.components = components
+        super(CyclicDependencyError, self).__init__(
+            "Cyclic dependencies exist among %s" % "; ".join(
+                ", ".join(repr(item) for item in component) for component in components))
 
 
-def toposort(data):
-    from functools import reduce
-
-    # Ignore self dependencies.
-    for k, v in data.items():
-        v.discard(k)
-    # Find all items that don't depend on anything.
-    try:
-        extra_items_in_deps = reduce(set.union, data.itervalues()) - set(data.iterkeys())
-    except Exception:
-        extra_items_in_deps = []
-    # Add empty dependences where needed
-    data.update(dict([(item, set()) for item in extra_items_in_deps]))
-    while True:
-        ordered = set(item for item, dep in data.iteritems() if not dep)
-        if not ordered:
-            break
-        for o in ordered:
-            yield o
-        data = dict([(item, (dep - ordered))
-                        for item, dep in data.iteritems()
-                            if item not in ordered])
-    if data:
-        print "Cyclic dependencies exist among these items:\n%s" % '\n'.join(repr(x) for x in data.iteritems())
-        print "\n-------------------------\n\n"
-        raise Exception()
-
-
-def topological_sort(graph_unsorted):
+class CyclicDependencyWarning(UserWarning):
     """
-    Repeatedly go through all of the nodes in the graph, moving each of
-    the nodes that has all its edges resolved, onto a sequence that
-    forms our sorted graph. A node has all of its edges resolved and
-    can be moved once all the nodes its edges point to, have been moved
-    from the unsorted graph onto the sorted one.
+    Warns that some items depend on each other and were sorted together.
+    ``components`` is the list of groups of items forming cycles.
     """
+    def __init__(self, components, key=repr):
+        self.components = components
+        super(CyclicDependencyWarning, self).__init__(
+            "Cyclic dependencies exist among %s" % "; ".join(
+                ", ".join(key(item) for item in component) for component in components))
 
-    # This is the list we'll return, that stores each node/edges pair
-    # in topological order.
-    graph_sorted = []
-
-    # Convert the unsorted graph into a hash table. This gives us
-    # constant-time lookup for checking if edges are unresolved, and
-    # for removing nodes from the unsorted graph.
-    graph_unsorted = dict(graph_unsorted)
-
-    # Run until the unsorted graph is empty.
-    while graph_unsorted:
-
-        # Go through each of the node/edges pairs in the unsorted
-        # graph. If a set of edges doesn't contain any nodes that
-        # haven't been resolved, that is, that are still in the
-        # unsorted graph, remove the pair from the unsorted graph,
-        # and append it to the sorted graph. Note here that by using
-        # using the items() method for iterating, a copy of the
-        # unsorted graph is used, allowing us to modify the unsorted
-        # graph as we move through it. We also keep a flag for
-        # checking that that graph is acyclic, which is true if any
-        # nodes are resolved during each pass through the graph. If
-        # not, we need to bail out as the graph therefore can't be
-        # sorted.
-        acyclic = False
-        for node, edges in graph_unsorted.items():
-            for edge in edges:
-                if edge in graph_unsorted:
-                    if node in graph_unsorted[edge]:
-                        print "Circular dependency", type(node), node.id, "and", type(edge), edge.id
+
+def strongly_connected_components(graph):
+    """
+    Return the strongly connected components of ``graph``, a
+    ``{node: iterable of nodes it points to}`` dict, as lists of nodes.
+
+    This is Tarjan's algorithm, without recursion so long chains don't hit
+    the recursion limit. Components come out in reverse topological order.
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in graph:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(graph.get(root, ())))]
+        while work:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor not in index:
+                    index[successor] = lowlink[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(graph.get(successor, ()))))
                     break
+                elif successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
             else:
-                acyclic = True
-                del graph_unsorted[node]
-                graph_sorted.append((node, edges))
-
-        if not acyclic:
-            # Uh oh, we've passed through all the unsorted nodes and
-            # weren't able to resolve any of them, which means there
-            # are nodes with cyclic edges that will never be resolved,
-            # so we bail out with an error.
-            raise RuntimeError("A cyclic dependency occurred")
-
-    return graph_sorted
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        item = stack.pop()
+                        on_stack.discard(item)
+                        component.append(item)
+                        if item == node:
+                            break
+                    components.append(component)
+    return components
+
+
+def toposort(data, key=None, cycles=None):
+    """
+    Yield the items of ``data``, a ``{item: set(items it depends on)}`` dict,
+    so that each item comes after everything it depends on.
+
+    Items that only appear as dependencies are yielded too and self
+    dependencies are ignored. Items that become ready at the same time are
+    yielded in the order of ``sorted(items, key=key)``, so the same graph
+    always produces the same order. ``data`` is not modified.
+
+    Items that depend on each other can't be ordered. If ``cycles`` is a
+    list, each group of such items (a strongly connected component) is
+    appended to it and its members are yielded together, as one block, once
+    everything the group depends on has been yielded. Otherwise a
+    ``CyclicDependencyError`` is raised.
+    """
+    in_degree = {}
+    dependents = defaultdict(list)
+    for item, deps in data.items():
+        in_degree.setdefault(item, 0)
+        for dep in deps:
+            if dep == item:
+                continue
+            in_degree.setdefault(dep, 0)
+            in_degree[item] += 1
+            dependents[dep].append(item)
+
+    ready = sorted((item for item, degree in in_degree.items() if degree == 0), key=key)
+    while ready:
+        next_ready = []
+        for item in ready:
+            yield item
+            for dependent in dependents.pop(item, ()):
+                in_degree[dependent] -= 1
+                if not in_degree[dependent]:
+                    next_ready.append(dependent)
+            del in_degree[item]
+        ready = sorted(next_ready, key=key)
+
+    if in_degree:
+        for item in _sort_cycles(data, in_degree, key, cycles):
+            yield item
+
+
+def _sort_cycles(data, remaining, key=None, cycles=None):
+    """
+    Order the ``remaining`` items that ``toposort`` couldn't, by sorting the
+    graph of their strongly connected components instead.
+    """
+    graph = dict(
+        (item, [dep for dep in data.get(item, ()) if dep in remaining and dep != item])
+        for item in remaining)
+    components = [sorted(component, key=key)
+                  for component in strongly_connected_components(graph)]
+    cyclic = [component for component in components if len(component) > 1]
+    if cycles is None:
+        raise CyclicDependencyError(cyclic)
+    cycles.extend(cyclic)
+
+    component_of = {}
+    for i, component in enumerate(components):
+        for item in component:
+            component_of[item] = i
+    deps = [set() for _ in components]
+    for item, item_deps in graph.items():
+        for dep in item_deps:
+            if component_of[dep] != component_of[item]:
+                deps[component_of[item]].add(component_of[dep])
+    component_data = dict((i, component_deps) for i, component_deps in enumerate(deps))
+
+    def component_key(i):
+        first = components[i][0]
+        return key(first) if key is not None else first
+    for i in toposort(component_data, key=component_key):
+        for item in components[i]:
+            yield item
+
+
+def topological_sort(graph_unsorted, key=None):
+    """
+    Return the ``(node, edges)`` pairs of ``graph_unsorted`` so that each
+    node comes after the nodes its edges point to.
+
+    ``graph_unsorted`` is a dict or a sequence of ``(node, edges)`` pairs.
+    Edges pointing to nodes that aren't in the graph are considered resolved.
+    Raises ``CyclicDependencyError`` if the graph has cycles.
+    """
+    graph = dict(graph_unsorted)
+    return [(node, graph[node]) for node in toposort(graph, key) if node in graph]
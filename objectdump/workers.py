@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Traversal of the object graph with a pool of worker processes.
+
+The root objects are split into shards and each worker process builds the
+key-only graph of its shard, with its own database connection. The graphs
+are merged in the parent, where the usual topological sort and
+serialization take place. Nodes reached from several shards are merged
+into one.
+"""
+import multiprocessing
+from collections import defaultdict
+
+from django.db import connections
+
+
+def shard(items, count):
+    """
+    Split ``items`` into at most ``count`` lists of about the same size
+    """
+    return [items[i::count] for i in range(count) if items[i::count]]
+
+
+def traverse_shard(args):
+    """
+    Build the graph of the objects reachable from one shard of root pks.
+    Runs in a worker process, so it only gets and returns picklable values.
+    """
+    from objectdump.management.commands.object_dump import Command
+    from objectdump.models import get_model, ObjectFilter
+    from objectdump.signals import has_receivers
+
+    model_label, pks, excludes, includes, using, limit, max_depth, concurrency = args
+    primary_model = get_model(*model_label.split("."))
+    cmd = Command()
+    cmd.using = using
+    cmd.concurrency = concurrency
+    cmd.hooks = has_receivers(Command)
+    objs = primary_model.objects.using(using).filter(pk__in=pks).iterator()
+    cmd.process_queue(objs, ObjectFilter(primary_model, list(excludes), includes),
+                      limit, max_depth)
+    return (
+        dict(cmd.depends_on),
+        dict((node, dict(fields)) for node, fields in cmd.relationships.items()),
+        dict(cmd.generates),
+        cmd.priors,
+    )
+
+
+def close_connections():
+    for connection in connections.all():
+        connection.close()
+
+
+def traverse_parallel(cmd, model_label, pks, workers, excludes=None,
+                      includes=None, limit=None, max_depth=None):
+    """
+    Build the graph of the objects reachable from the ``pks`` of
+    ``model_label`` with ``workers`` processes and merge it into the
+    ``depends_on``, ``relationships``, ``generates`` and ``priors`` of
+    ``cmd``, as ``cmd.process_queue`` would.
+    """
+    cmd.depends_on = defaultdict(set)
+    cmd.relationships = defaultdict(lambda: defaultdict(set))
+    cmd.generates = defaultdict(set)
+    cmd.priors = {}
+    cmd.plans = {}
+    shards = [(model_label, pks_shard, excludes or [], includes, cmd.using, limit,
+               max_depth, cmd.concurrency)
+              for pks_shard in shard(list(pks), workers)]
+    if not shards:
+        return
+
+    # Connections can't be shared with the forked processes, each one opens
+    # its own.
+    close_connections()
+    pool = multiprocessing.Pool(min(workers, len(shards)), initializer=close_connections)
+    try:
+        for depends_on, relationships, generates, priors in pool.imap_unordered(traverse_shard, shards):
+            for node, deps in depends_on.items():
+                cmd.depends_on[node].update(deps)
+            for node, fields in relationships.items():
+                for field, nodes in fields.items():
+                    cmd.relationships[node][field].update(nodes)
+            for node, nodes in generates.items():
+                cmd.generates[node].update(nodes)
+            for node, serialized in priors.items():
+                cmd.priors[node] = cmd.priors.get(node, False) or serialized
+    finally:
+        pool.terminate()
+        pool.join()